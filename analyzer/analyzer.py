@@ -1,93 +1,170 @@
-import dateutil.parser
 import pandas as pd
+import numpy as np
+import bz2
+import io
 import os
-import dateutil
 import time
-from concurrent.futures import ThreadPoolExecutor
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
+import metrics
+import mylogging
 import timescaledb_model as tsdb
+from snapshot_cache import SnapshotCache
+from discovery import FileManifest
+from indicators import WINDOW, compute_indicators
 
-db = tsdb.TimescaleStockMarketModel('bourse', 'ricou', 'db', 'monmdp')        # inside docker
-#db = tsdb.TimescaleStockMarketModel('bourse', 'ricou', 'localhost', 'monmdp') # outside docker
+DB_ARGS = ('bourse', 'ricou', 'db', 'monmdp')        # inside docker
+#DB_ARGS = ('bourse', 'ricou', 'localhost', 'monmdp') # outside docker
+# companies whose indicators are computed and written at once, the memory used
+# depends on their history only
+INDICATORS_BATCH = 100
+
+# connection of the current process, opened by connect_database (one per ingestion worker)
+db = None
+
+def connect_database(setup=True, aggregate=False):
+    global db
+    db = tsdb.TimescaleStockMarketModel(*DB_ARGS, setup=setup, aggregate=aggregate)
+    return db
+
+# columnar cache of the snapshots (see snapshot_cache.py), None to read the bz2 files
+cache = None
+
+def open_cache(root):
+    global cache
+    cache = SnapshotCache(root) if root else None
+    return cache
+
+# metrics of the current run, merged from the tasks (see metrics.py)
+report = None
 
 # GENERATING THE PATHS DATAFRAMES
 
-def generate_path(year):
-    for path, _, files in os.walk(f'data/{year}'):
-        for file in files:
-            yield os.path.join(path, file)
-
-def process_file_path(file):
-    path = file.split('/')[-1] # get the file name
-    path = path[:-4] # remove the extension .bz2
-    path_without_letters = ''.join([i for i in path if not i.isalpha()]) # remove the letters to keep only the date
-    date = dateutil.parser.parse(path_without_letters) # convert the string to a datetime
-    return file, date
-
-def create_path_df():
-    # Create a dictionary to store paths for each category
-    categories = {'compA': [], 'compB': [], 'amsterdam': [], 'peapme': []}
-
-    # Function to process files and update the dictionary
-    def update_categories(file, date):
-        for category in categories:
-            if category in file:
-                categories[category].append((file, date))
-                break
-
-    # Generate file paths
-    file_paths = [file for year in range(2019, 2024) for file in generate_path(year)]
-
-    # Process files in parallel
-    with ThreadPoolExecutor() as executor:
-        for file, date in executor.map(process_file_path, file_paths):
-            update_categories(file, date)
-
-    # Convert dictionary to DataFrames
-    dfs = {
-        category: pd.DataFrame({'path': [path for path, _ in paths]}, 
-                            index=pd.to_datetime([date for _, date in paths]))
-        for category, paths in categories.items()
-    }
-
-    return dfs['compA'], dfs['compB'], dfs['amsterdam'], dfs['peapme']
+def create_path_df(aliases, manifest_file=None):
+    # files of every year directory (data/2019, data/2020...), only the directories
+    # changed since the last run are listed again (see discovery.py)
+    years = sorted(d for d in os.listdir('data') if d.isdigit())
+    files = FileManifest(manifest_file, list(aliases)).scan([os.path.join('data', year) for year in years])
+
+    # Convert to one DataFrame per market alias (category of the files)
+    files = files.set_index('date')
+    return {alias: files.loc[files['category'] == alias, ['path']] for alias in aliases}
+
+def group_markets(registry, path_dfs):
+    # one pipeline by market id, with the files of all its aliases (peapme and euronx
+    # are both market 1): they share the companies of the market and its cache days
+    aliases = {}
+    for alias, mid in registry.items():
+        aliases.setdefault(mid, []).append(alias)
+    return {mid: ('/'.join(names), pd.concat([path_dfs[alias].assign(alias=alias) for alias in names]))
+            for mid, names in aliases.items()}
 
 # FEEDING THE DATABASES
 
+# class of the characters of a price: 1 digit, 2 point, 3 minus, 4 ignored (padding, space and the
+# letters of (c) and (s)), 0 anything else
+PRICE_CHARS = np.zeros(128, dtype='int8')
+PRICE_CHARS[ord('0'):ord('9') + 1] = 1
+PRICE_CHARS[ord('.')] = 2
+PRICE_CHARS[ord('-')] = 3
+PRICE_CHARS[[0, ord(' '), ord('('), ord(')'), ord('c'), ord('s')]] = 4
+
+def parse_prices(values):
+    # vectorized parse of the prices (ex : 123.54(c) -> 123.54, 1 234.5 -> 1234.5): the strings are
+    # viewed as a matrix of code points, read one character position at a time for all the rows.
+    # Up to 15 digits mantissa / 10**decimals is exactly float(string), other strings take the regex path.
+    chars = np.asarray(values, dtype=str)
+    n = len(chars)
+    if n == 0 or chars.dtype.itemsize == 0:
+        return np.full(n, np.nan)
+    codes = np.ascontiguousarray(chars.view(np.uint32).reshape(n, -1).T)
+
+    mantissa = np.zeros(n)
+    n_digits = np.zeros(n, dtype='int64')
+    decimals = np.zeros(n, dtype='int64')
+    n_points = np.zeros(n, dtype='int64')
+    negative = np.zeros(n, dtype=bool)
+    fast = np.ones(n, dtype=bool)
+    for column in codes:
+        kind = PRICE_CHARS[np.minimum(column, 127)]
+        is_digit = kind == 1
+        mantissa = np.where(is_digit, mantissa * 10 + (column.astype('int64') - 48), mantissa)
+        n_digits += is_digit
+        decimals += is_digit & (n_points > 0)
+        n_points += kind == 2
+        # one minus sign, before the digits
+        is_minus = kind == 3
+        fast &= ~is_minus | ~negative & (n_digits == 0)
+        negative |= is_minus
+        fast &= kind != 0
+    fast &= (n_digits > 0) & (n_digits <= 15) & (n_points <= 1)
+
+    prices = mantissa / 10.0 ** decimals
+    prices[negative] *= -1
+    if not fast.all():
+        slow = pd.Series(chars[~fast])
+        prices[~fast] = slow.str.replace(r'\([cs]\)', '', regex=True).replace(r' ', '', regex=True).astype(float)
+    return prices
+
+def read_snapshot(path, counter=''):
+    # bz2 pickle of a snapshot, decompressed and unpickled in two timed stages. The
+    # file and its bytes are counted under the counter prefix, the files read again
+    # for another purpose are not counted with the ingested ones
+    with metrics.stage('decompress'):
+        with open(path, 'rb') as f:
+            data = f.read()
+        metrics.add(counter + 'files')
+        metrics.add(counter + 'bytes_compressed', len(data))
+        data = bz2.decompress(data)
+        metrics.add(counter + 'bytes_decompressed', len(data))
+    with metrics.stage('unpickle'):
+        return pd.read_pickle(io.BytesIO(data), compression=None)
+
 def clean_df(df):
-    df = df.dropna()
-    # used in feed_stocks so symbol and name are not needed
-    df = df.drop(columns=['symbol', 'name'])
-    # removing the (c) and (s) from the last column and converting it to float (ex : 123.54(c) -> 123.54)
-    df['last'] = df['last'].astype(str).str.replace(r'\([cs]\)', '', regex=True).replace(r' ', '', regex=True)
-    df['last'] = df['last'].astype(float)
+    # drop the rows with a missing value, the symbol and name columns (not
+    # needed by feed_stocks) and the rows without volume, building the result once
+    keep = df.notna().to_numpy().all(axis=1)
+    last = df['last'].to_numpy()[keep]
+    # the prices are strings with a (c) or (s) suffix, unless the column is already numeric
+    if pd.api.types.is_numeric_dtype(df['last']):
+        last = last.astype(float)
+    else:
+        last = parse_prices(last)
     # converting the volume to int
-    df['volume'] = df['volume'].astype(int)
-    df = df[df['volume'] != 0]
-    return df
+    volume = df['volume'].to_numpy()[keep].astype(int)
+    traded = volume != 0
+    metrics.add('rows_read', len(df))
+    metrics.add('rows_missing', len(df) - len(volume))
+    metrics.add('rows_zero_volume', len(volume) - int(traded.sum()))
+    return pd.DataFrame({'last': last[traded], 'volume': volume[traded]}, index=df.index[keep][traded])
 
-def feed_companies(path_df, mid):
-    pea = (mid == 1)
-    # Keep the last index of each day
-    path_df = path_df.resample('D').last()
-    # Drop the days with no data -> stock market closed
-    path_df = path_df.dropna()
+# the companies of the last snapshot of each day
+def iter_companies(mid, day_paths, dates):
+    for day in dates:
+        with metrics.day(mid, day):
+            if cache is not None:
+                df = cache.companies(mid, day)
+            else:
+                # Read the pickle files again and drop the columns not needed
+                df = pd.concat([read_snapshot(path, 'companies_') for path in day_paths[day]])
+                df = df.drop(columns=['last', 'volume'])
+        yield df
 
-    # Initialize an empty list to store dataframes
-    dfs = []
-    
-    for _, file in path_df.iterrows():
-        # Read the pickle file
-        df = pd.read_pickle(file['path'])
-        # Drop the columns not needed
-        df.drop(columns=['last', 'volume'], inplace=True)
-        # Append to the list of dataframes
-        dfs.append(df)
+def feed_companies(companies_dfs, mid):
+    pea = (mid == 1)
+    dfs = list(companies_dfs)
+    if not dfs:
+        return
         
     # Concatenate all dataframes
     combined_df = pd.concat(dfs)
     # Remove duplicates, keeping the last occurence of the idnex
     combined_df = combined_df[~combined_df.index.duplicated(keep='last')]
+    # Only insert the companies not known yet (incremental run)
+    known = [symbol for symbol, in db.raw_query("SELECT symbol FROM companies WHERE mid = %s", (mid,))]
+    combined_df = combined_df[~combined_df.index.isin(known)]
     
     df_output = pd.DataFrame({
         'name': combined_df['name'],
@@ -101,63 +178,382 @@ def feed_companies(path_df, mid):
         'sector': 0
     })
     
-    db.df_write_optimized(df_output, table="companies")
-    db.commit()
-    
-# helper function that will load the data from the pickle file for a whole day and return a dataframe
-def load_daystock(path_df, date):
-    path_df = path_df[path_df.index.date == date.date()]
-    dfs = []
-    for _, file in path_df.iterrows():
-        df = clean_df(pd.read_pickle(file['path']))
-        dfs.append(df)
-    return pd.concat(dfs)
-    
-def feed_stocks_byday(path_df, cids):
-    daypath_list = path_df.resample('D').last().dropna().index
-    for date in daypath_list:
-        df = load_daystock(path_df, date)
-        if df.empty:
-            continue
-        
-        merged_df = pd.merge(cids, df, left_on='symbol', right_index=True, how='inner')
-        merged_df = merged_df.rename(columns={'id': 'cid', 'last': 'value'})
-        merged_df['date'] = date
-        merged_df = merged_df[['date', 'cid', 'value', 'volume']]
-        
-        daystocks_df = merged_df.groupby('cid').agg(
-            open=('value', 'first'),
-            close=('value', 'last'),
-            high=('value', 'max'),
-            low=('value', 'min'),
-            volume=('volume', 'max')
-        ).reset_index()
-        daystocks_df['date'] = date
-        daystocks_df = daystocks_df[['date', 'cid', 'open', 'close', 'high', 'low', 'volume']]
-        
-        db.df_write_optimized(merged_df, table="stocks")
-        db.df_write_optimized(daystocks_df, table="daystocks")
+    with metrics.stage('copy_companies'):
+        db.df_write_optimized(df_output, table="companies")
         db.commit()
     
-def feed_database():
-    df_compA, df_compB, df_amsterdam, df_peapme = create_path_df()
-        
-    feed_companies(df_compA, 7)
-    feed_companies(df_compB, 8)
-    feed_companies(df_amsterdam, 6)
-    feed_companies(df_peapme, 1)
-    
-    cids = {}
-    for mid in [7, 8, 6, 1]:
-        cids[mid] = db.df_query(f"SELECT id, symbol FROM companies WHERE mid = {mid}")
-        cids[mid] = [cid for cid in cids[mid]]
-        cids[mid] = pd.concat(cids[mid])
-    
-    feed_stocks_byday(df_compA, cids[7])
-    feed_stocks_byday(df_compB, cids[8])
-    feed_stocks_byday(df_amsterdam, cids[6])
-    feed_stocks_byday(df_peapme, cids[1])
+def group_paths_by_day(path_df):
+    # paths of every market day in time order (indexed by their timestamp), grouped in one pass
+    path_df = path_df.sort_index()
+    return {day: paths for day, paths in path_df['path'].groupby(path_df.index.normalize())}
+
+def last_paths_by_day(path_df, dates):
+    # the last snapshot of every alias of the market on each day, their companies are
+    # the companies of the day
+    path_df = path_df.sort_index()
+    last = path_df.groupby([path_df.index.normalize(), 'alias']).tail(1)
+    dates = set(dates)
+    return {day: paths for day, paths in last['path'].groupby(last.index.normalize()) if day in dates}
+
+def pending_days(day_paths, done=frozenset()):
+    # the days with files not in file_done yet (all the days with at least one
+    # snapshot on a first run) and among them the days partly written by a
+    # previous run, which are deleted and written again
+    dates, redo = [], set()
+    for day, paths in day_paths.items():
+        n_done = sum(path in done for path in paths)
+        if n_done < len(paths):
+            dates.append(day)
+            if n_done > 0:
+                redo.add(day)
+    return dates, redo
+
+# helper function that will load the data of a day, one snapshot at a time
+def iter_daystock(mid, date, paths):
+    if cache is not None and cache.is_cached(mid, date, paths):
+        return metrics.timed(cache.iter_snapshots(mid, date), 'cache_read')
+    return clean_snapshots(read_snapshot(path) for path in paths)
+
+def clean_snapshots(raw_dfs):
+    for raw_df in raw_dfs:
+        with metrics.stage('clean'):
+            df = clean_df(raw_df)
+        yield df
+
+def update_daystock(day_df, snap_df):
+    # merge the open/close/high/low/volume of one more snapshot into the ones of the day
+    if day_df is None:
+        return snap_df
+    day_df, snap_df = day_df.align(snap_df)
+    return pd.DataFrame({
+        'open': day_df['open'].fillna(snap_df['open']),
+        'close': snap_df['close'].fillna(day_df['close']),
+        'high': np.fmax(day_df['high'], snap_df['high']),
+        'low': np.fmin(day_df['low'], snap_df['low']),
+        'volume': np.fmax(day_df['volume'], snap_df['volume'])
+    })
+
+def iter_stocks(snapshots, times, cids):
+    # the stocks rows of each snapshot of a day, dated with the time of the snapshot
+    for snap_time, df in zip(times, snapshots):
+        with metrics.stage('merge'):
+            merged_df = pd.merge(cids, df, left_on='symbol', right_index=True, how='inner')
+            if merged_df.empty:
+                continue
+            merged_df = merged_df.rename(columns={'id': 'cid', 'last': 'value'})
+            merged_df['date'] = snap_time
+            merged_df = merged_df[['date', 'cid', 'value', 'volume']]
+        yield merged_df
+
+def aggregate_daystock(stock_dfs, date):
+    # daystocks of one day from its stocks, one snapshot at a time, None without stocks
+    day_df = None
+    for merged_df in stock_dfs:
+        with metrics.stage('aggregate'):
+            if merged_df['cid'].is_unique:
+                snap_df = merged_df.set_index('cid')['value'].to_frame('open')
+                snap_df['close'] = snap_df['high'] = snap_df['low'] = snap_df['open']
+                snap_df['volume'] = merged_df['volume'].values
+            else:
+                snap_df = merged_df.groupby('cid').agg(
+                    open=('value', 'first'),
+                    close=('value', 'last'),
+                    high=('value', 'max'),
+                    low=('value', 'min'),
+                    volume=('volume', 'max')
+                )
+            day_df = update_daystock(day_df, snap_df)
+
+    if day_df is None:
+        return None
+    daystocks_df = day_df.reset_index(names='cid')
+    daystocks_df['volume'] = daystocks_df['volume'].astype('int64')
+    daystocks_df['date'] = date
+    return daystocks_df[['date', 'cid', 'open', 'close', 'high', 'low', 'volume']]
+
+def write_stocks(stock_dfs):
+    for merged_df in stock_dfs:
+        with metrics.stage('copy_stocks'):
+            db.df_write_optimized(merged_df, table="stocks")
+        metrics.add('rows_copied_stocks', len(merged_df))
+        yield merged_df
+
+def write_daystock(snapshots, times, cids, date):
+    # stream the snapshots of one day: each one is merged with the company ids
+    # and written to stocks while the daystocks aggregates are updated, so only
+    # one snapshot is in memory at a time. The caller commits.
+    stock_dfs = write_stocks(iter_stocks(snapshots, times, cids))
+    if db.is_daystocks_aggregate():
+        # daystocks is a continuous aggregate of stocks, computed by TimescaleDB
+        for _ in stock_dfs:
+            pass
+        return
+    daystocks_df = aggregate_daystock(stock_dfs, date)
+    if daystocks_df is not None:
+        with metrics.stage('copy_daystocks'):
+            db.df_write_optimized(daystocks_df, table="daystocks")
+        metrics.add('rows_copied_daystocks', len(daystocks_df))
+
+def check_daystocks(markets, n_days, seed=0):
+    # compare the daystocks of n_days random days of every market with the ones
+    # computed again by pandas, to check the continuous aggregate. Return the
+    # number of rows which differ.
+    rng = np.random.default_rng(seed)
+    errors = 0
+    for mid, (alias, path_df) in markets.items():
+        day_paths = group_paths_by_day(path_df)
+        cids = db.fetch_df("SELECT id, symbol FROM companies WHERE mid = %s", (mid,))
+        days = list(day_paths)
+        for i in sorted(rng.choice(len(days), min(n_days, len(days)), replace=False)):
+            day, paths = days[i], day_paths[days[i]]
+            expected = aggregate_daystock(iter_stocks(iter_daystock(mid, day, paths), paths.index, cids), day)
+            if expected is None:
+                continue
+            actual = db.get_daystocks(day, expected['cid'].tolist())
+            merged = pd.merge(expected, actual, on='cid', how='outer', suffixes=('', '_db'), indicator=True)
+            diff = merged['_merge'] != 'both'
+            for column in ['open', 'close', 'high', 'low']:
+                # float4 in the database
+                diff |= merged[column].astype('float32') != merged[column + '_db'].astype('float32')
+            diff |= merged['volume'] != merged['volume_db']
+            if diff.any():
+                db.logger.warning('daystocks of market %s on %s differ for the companies %s'
+                                  % (alias, day.date(), merged.loc[diff, 'cid'].tolist()))
+            errors += int(diff.sum())
+    return errors
+
+def feed_stocks_days(day_paths, mid, cids, dates, redo=()):
+    for date in dates:
+        with metrics.day(mid, date):
+            paths = day_paths[date]
+            if date in redo:
+                db.delete_day(date, cids['id'].tolist(), paths.tolist())
+            write_daystock(iter_daystock(mid, date, paths), paths.index, cids, date)
+            # same transaction as the data, a crash loses both or none
+            db.set_files_done(paths)
+    # the commit of a batch of days is counted on its last day
+    with metrics.day(mid, dates[-1] if dates else None):
+        with metrics.stage('commit'):
+            db.commit()
+        metrics.add('commits')
+
+def feed_stocks_byday(day_paths, mid, cids, dates, redo=(), batch_size=1, pool=None):
+    # one task and one transaction every batch_size days
+    tasks = [(mid, {date: day_paths[date] for date in dates[i:i + batch_size]}, redo, cids)
+             for i in range(0, len(dates), batch_size)]
+    for mid, n, task_metrics in run_tasks(pool, process_days, tasks):
+        db.logger.debug('market %d: %d days written', mid, n)
+        report.merge(task_metrics, n)
+
+# SNAPSHOT CACHE
+
+def convert_day(task):
+    # decompress and clean the snapshots of one market day, stored by the parent in the cache
+    mid, day, paths, times, last_paths = task
+    offsets, symbols, last, volume, companies_dfs = [0], [], [], [], []
+    with metrics.day(mid, day):
+        for path in paths:
+            raw_df = read_snapshot(path)
+            if path in last_paths:
+                companies_dfs.append(raw_df)
+            with metrics.stage('clean'):
+                df = clean_df(raw_df)
+            offsets.append(offsets[-1] + len(df))
+            symbols.append(df.index.to_numpy())
+            last.append(df['last'].to_numpy())
+            volume.append(df['volume'].to_numpy())
+    # companies of the last snapshot of every alias, for feed_companies
+    companies_df = pd.concat(companies_dfs)
+    companies_df = companies_df[~companies_df.index.duplicated(keep='last')]
+    companies, names = companies_df.index.to_numpy(), companies_df['name'].fillna('').to_numpy()
+    return (mid, day, paths, times, offsets, np.concatenate(symbols), np.concatenate(last),
+            np.concatenate(volume), companies, names, metrics.take())
+
+def update_cache(day_paths, last_paths, mid, dates, pool=None):
+    # convert the days to ingest which are not in the cache yet, or got new files
+    tasks = [(mid, day, day_paths[day].tolist(), day_paths[day].index.as_unit('ns').asi8,
+              set(last_paths[day]))
+             for day in dates if not cache.is_cached(mid, day, day_paths[day])]
+    for *day, task_metrics in run_tasks(pool, convert_day, tasks):
+        start = time.perf_counter()
+        cache.write_day(*day)
+        task_metrics.setdefault((mid, day[1]), {})['cache_write_seconds'] = time.perf_counter() - start
+        report.merge(task_metrics)
+
+# MARKET PIPELINES
+
+# Each market of the registry (markets and market_aliases tables) is ingested by its own
+# pipeline, with the files of all its aliases: cache conversion, companies, then stocks.
+# The pipelines are independent and run concurrently, their tasks sharing one process
+# pool. Every worker has its own connection, so a market can be loaded while another
+# one is still aggregating.
+
+def init_worker(cache_root, worker_logs=None):
+    # the logs are written by the parent process, before the loggers are created
+    if worker_logs is not None:
+        mylogging.log_to_queue(worker_logs)
+    open_cache(cache_root)
+    # each worker writes through its own connection
+    connect_database(setup=False)
+
+def run_tasks(pool, function, tasks):
+    # yield the results of the tasks as they complete, computed by the
+    # process pool, or one after the other in this process without pool
+    if pool is None:
+        for task in tasks:
+            yield function(task)
+    else:
+        for future in as_completed([pool.submit(function, task) for task in tasks]):
+            yield future.result()
+
+def process_companies(task):
+    # insert the new companies of a market, return the ids of all its companies
+    mid, day_paths, dates = task
+    with metrics.day(mid, None):
+        feed_companies(iter_companies(mid, day_paths, dates), mid)
+    return db.fetch_df("SELECT id, symbol FROM companies WHERE mid = %s", (mid,)), metrics.take()
+
+def process_days(task):
+    # a task is a batch of days of one market, decompressed, cleaned,
+    # aggregated and written in one transaction by the worker
+    mid, day_paths, redo, cids = task
+    feed_stocks_days(day_paths, mid, cids, list(day_paths), redo)
+    return mid, len(day_paths), metrics.take()
+
+def feed_market(alias, mid, path_df, done=frozenset(), batch_size=1, pool=None):
+    day_paths = group_paths_by_day(path_df)
+    dates, redo = pending_days(day_paths, done)
+    if not dates:
+        return []
+    db.logger.info('market %s (%d): %d days to ingest', alias, mid, len(dates))
+    report.expect(len(dates))
+
+    last_paths = last_paths_by_day(path_df, dates)
+    # bz2 is decompressed once, the days are then read from the cache
+    if cache is not None:
+        update_cache(day_paths, last_paths, mid, dates, pool)
+
+    cids, task_metrics = next(run_tasks(pool, process_companies, [(mid, last_paths, dates)]))
+    report.merge(task_metrics)
+
+    feed_stocks_byday(day_paths, mid, cids, dates, redo, batch_size, pool)
+    return dates
+
+def update_indicators(since=None):
+    # extend the indicators of every company with its new days. since is the first day
+    # ingested by the run: the indicators after it are computed again if it is an old day
+    if since is not None:
+        db.delete_indicators(since)
+    cids = db.get_company_ids()
+    n_values = 0
+    for i in range(0, len(cids), INDICATORS_BATCH):
+        closes, state = db.get_indicator_input(since, WINDOW - 1, cids[i:i + INDICATORS_BATCH])
+        if closes.empty:
+            continue
+        indicators_df = compute_indicators(closes, state)
+        db.df_write_optimized(indicators_df[['date', 'cid', 'indicator', 'value']], table="indicators")
+        n_values += len(indicators_df)
+    db.commit()
+    db.logger.info('%d indicator values written', n_values)
+
+def feed_database(workers=1, batch_size=1, incremental=True, manifest_file=None, markets=None,
+                  check_days=0, report_file=None, progress=30):
+    # report_file: JSON report of the stage times and counters of the run, by market and
+    # day. progress: seconds between two progress lines. Return the metrics.RunReport
+    global report
+    report = metrics.RunReport(progress, db.logger)
+    # alias -> id of the markets to ingest
+    registry = db.get_market_ids()
+    if markets:
+        registry = {alias: registry[alias] for alias in markets}
+    with report.phase('discovery'):
+        market_paths = group_markets(registry, create_path_df(registry, manifest_file))
+
+    # files already written by a previous run are skipped
+    done = db.get_files_done() if incremental else frozenset()
+
+    with report.phase('markets'):
+        if workers > 1:
+            # spawn rather than fork: a forked child would share the parent connection
+            ctx = multiprocessing.get_context('spawn')
+            cache_root = cache.root if cache is not None else None
+            # the workers send their logs to this process, the only one writing the log files
+            worker_logs, log_listener = mylogging.listen_workers(ctx)
+            try:
+                with ProcessPoolExecutor(workers, mp_context=ctx, initializer=init_worker,
+                                         initargs=(cache_root, worker_logs)) as pool, \
+                     ThreadPoolExecutor(len(market_paths)) as pipelines:
+                    futures = [pipelines.submit(feed_market, alias, mid, path_df, done, batch_size, pool)
+                               for mid, (alias, path_df) in market_paths.items()]
+                    dates = [date for future in futures for date in future.result()]
+            finally:
+                # after the workers exit, their last messages are written
+                log_listener.stop()
+        else:
+            dates = [date for mid, (alias, path_df) in market_paths.items()
+                     for date in feed_market(alias, mid, path_df, done, batch_size)]
+    if dates:
+        report.print_progress()
+
+    if db.is_daystocks_aggregate():
+        # materialize the days changed by the new stocks at once
+        with report.phase('refresh_daystocks'):
+            db.refresh_daystocks()
+
+    if dates:
+        if db.is_continuous_aggregate('yearstocks'):
+            # after daystocks, which it aggregates
+            with report.phase('refresh_yearstocks'):
+                db.refresh_aggregate('yearstocks')
+        with report.phase('indicators'):
+            update_indicators(min(dates))
+        with report.phase('ytd_baselines'):
+            db.update_ytd_baselines(min(dates), commit=True)
+        # the chunks are compressed once loaded, not during the backfill
+        db.add_compression_policies()
+        # the dashboard empties its caches when this changes
+        db.set_tag('last_ingestion', pd.Timestamp.now(tz='UTC').isoformat(), commit=True)
+        print('stages: %s' % report.summary())
+
+    if check_days:
+        with report.phase('check_daystocks'):
+            errors = check_daystocks(market_paths, check_days)
+        print('daystocks check: %d rows differ' % errors)
+
+    if report_file is not None:
+        report.save(report_file, {mid: alias.split('/') for mid, (alias, _) in market_paths.items()})
+    return report
 
 if __name__ == '__main__':
-    feed_database()
+    parser = argparse.ArgumentParser(description='Feed the bourse database with the Boursorama snapshots')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help='number of ingestion processes, 1 to ingest in this process (default: number of cores)')
+    parser.add_argument('-b', '--batch-size', type=int, default=5,
+                        help='number of market days written per transaction (default: 5)')
+    parser.add_argument('--full', action='store_true',
+                        help='do not skip the files listed in file_done, for a fresh database')
+    parser.add_argument('--cache', default='data/cache',
+                        help='directory of the columnar snapshot cache (default: data/cache)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='read the bz2 files directly, without the cache')
+    parser.add_argument('--manifest', default='data/manifest.pkl',
+                        help='manifest of the files found by the previous runs (default: data/manifest.pkl)')
+    parser.add_argument('-m', '--markets', nargs='+', metavar='ALIAS',
+                        help='aliases of the markets to ingest (default: all the markets of the database)')
+    parser.add_argument('--aggregate', action='store_true',
+                        help='on a new database, compute daystocks with a TimescaleDB continuous aggregate')
+    parser.add_argument('--check-daystocks', type=int, default=0, metavar='N',
+                        help='compare the daystocks of N random days of every market with pandas (default: 0)')
+    parser.add_argument('--report', default='data/report.json',
+                        help='JSON report of the times and counters of the run, by market and day '
+                             '(default: data/report.json)')
+    parser.add_argument('--progress', type=float, default=30, metavar='SECONDS',
+                        help='seconds between two progress lines (default: 30)')
+    args = parser.parse_args()
+
+    connect_database(aggregate=args.aggregate)
+    open_cache(None if args.no_cache else args.cache)
+    feed_database(args.workers, args.batch_size, incremental=not args.full, manifest_file=args.manifest,
+                  markets=args.markets, check_days=args.check_daystocks, report_file=args.report,
+                  progress=args.progress)
     print("Done")
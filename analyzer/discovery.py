@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+'''
+  Discovery of the Boursorama snapshot files.
+
+  The file names follow a fixed format, "<market> <YYYY-MM-DD HH:MM:SS.ffffff>.bz2",
+  so they are parsed all at once with pandas string methods and one
+  pd.to_datetime call. Names in another format fall back to dateutil.
+
+  The files found are kept in a manifest (a pickle) with the mtime of their
+  directory. On the next scan only the directories whose mtime changed are
+  listed again, and only their new names are parsed. The snapshot files are
+  never modified once written, so the directory mtime is enough.
+
+  >>> df = parse_file_names(['data/2020/compA 2020-01-02 09:02:02.532411.bz2',
+  ...                         'data/2020/peapme 2020-01-02 09:12:02.bz2'])
+  >>> df['category'].tolist()
+  ['compA', 'peapme']
+  >>> df['date'].tolist()
+  [Timestamp('2020-01-02 09:02:02.532411'), Timestamp('2020-01-02 09:12:02')]
+'''
+
+import os
+import pickle
+import dateutil.parser
+import pandas as pd
+
+CATEGORIES = ['compA', 'compB', 'amsterdam', 'peapme']
+
+
+def empty_files():
+    return pd.DataFrame({'path': pd.Series(dtype=object), 'category': pd.Series(dtype=object),
+                         'date': pd.Series(dtype='datetime64[ns]')})
+
+
+def parse_file_date(name):
+    '''Date of a file name in any format, the slow path'''
+    name = name[:-4]  # remove the extension .bz2
+    name_without_letters = ''.join([i for i in name if not i.isalpha()])  # keep only the date
+    return dateutil.parser.parse(name_without_letters)
+
+
+def parse_file_names(paths, categories=CATEGORIES):
+    '''Return the category (market alias) and the date of every file
+
+    :param paths: paths of the snapshot files
+    :param categories: the known categories, looked for in the names not in the fixed format
+    :return: a dataframe with the path, category and date columns. Every file is kept, so the
+        files of a market added later to the registry are already in the manifest
+    '''
+    paths = pd.Series(list(paths), dtype=object)
+    if paths.empty:
+        return empty_files()
+    # "<category> <YYYY-MM-DD HH:MM:SS.ffffff>.bz2": the category ends at the first space of
+    # the file name and the date is at a fixed position from the end
+    category = pd.Series([path[path.rfind('/') + 1:path.find(' ', path.rfind('/'))] for path in paths],
+                         dtype=object)
+    dates = pd.to_datetime(paths.str[-30:-4], format='%Y-%m-%d %H:%M:%S.%f', errors='coerce')
+
+    # names not in the fixed format: the category is looked for in the whole path
+    for i in paths.index[dates.isna()]:
+        category[i] = next((c for c in categories if c in paths[i]), None)
+        if category[i] is not None:
+            dates[i] = parse_file_date(os.path.basename(paths[i]))
+
+    return pd.DataFrame({'path': paths, 'category': category, 'date': dates})
+
+
+def concat_files(dfs):
+    dfs = [df for df in dfs if len(df)]
+    return pd.concat(dfs, ignore_index=True) if dfs else empty_files()
+
+
+class FileManifest:
+    """ Files found by the previous scans, by directory."""
+
+    def __init__(self, filename=None, categories=CATEGORIES):
+        '''
+        :param filename: pickle of the manifest, None to keep it in memory only
+        '''
+        self.filename = filename
+        self.categories = categories
+        self.__dirs = {}  # directory -> (mtime, subdirectories, files dataframe)
+        if filename is not None and os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                self.__dirs = pickle.load(f)
+
+    def save(self):
+        if self.filename is None:
+            return
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        with open(self.filename + '.tmp', 'wb') as f:
+            pickle.dump(self.__dirs, f)
+        os.replace(self.filename + '.tmp', self.filename)
+
+    def __scan_dir(self, directory):
+        # list the directory again only if it changed since the last scan
+        mtime = os.stat(directory).st_mtime_ns
+        known = self.__dirs.get(directory)
+        if known is not None and known[0] == mtime:
+            return known[1]
+        subdirs, files = [], []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirs.append(entry.path)
+                else:
+                    files.append(entry.path)
+        old = known[2] if known is not None else empty_files()
+        old = old[old['path'].isin(files)]
+        new = parse_file_names(pd.Index(files).difference(old['path']), self.categories)
+        self.__dirs[directory] = (mtime, subdirs, concat_files([old, new]))
+        return subdirs
+
+    def scan(self, roots):
+        '''Return the files below the roots (path, category and date columns)
+        and save the manifest
+        '''
+        seen = []
+        stack = [root for root in roots if os.path.isdir(root)]
+        while stack:
+            directory = stack.pop()
+            seen.append(directory)
+            stack += self.__scan_dir(directory)
+        # forget the directories which disappeared
+        self.__dirs = {d: self.__dirs[d] for d in seen}
+        self.save()
+        return concat_files([self.__dirs[d][2] for d in seen])
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
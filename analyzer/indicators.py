@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+'''
+  Technical indicators of the daystocks, stored in the indicators hypertable
+  (date, cid, indicator, value) for the dashboard.
+
+  They are computed by the analyzer after each run, only for the new days: the
+  moving windows are filled with the WINDOW - 1 previous closes of each company
+  and the recursive ones (EMA, averages of the RSI) start from their values of
+  the last stored day, so the series are the ones a computation of the whole
+  history would give.
+
+  >>> import numpy as np
+  >>> closes = pd.DataFrame({'date': pd.date_range('2020-01-01', periods=30), 'cid': 1,
+  ...                        'close': np.arange(30, dtype=float)})
+  >>> full = compute_indicators(closes)
+  >>> old = full[full['date'] < '2020-01-21']
+  >>> new = compute_indicators(closes[closes['date'] >= '2020-01-02'], last_state(old))
+  >>> pd.testing.assert_frame_equal(full[full['date'] >= '2020-01-21'].reset_index(drop=True), new)
+  >>> full.pivot(index='date', columns='indicator', values='value').iloc[-1].round(2).tolist()
+  [19.5, 5.92, 31.33, 7.67, 20.02, 100.0, 1.0, 0.0]
+'''
+
+import pandas as pd
+
+# id of the indicators in the indicators table (indicator_names gives their names)
+INDICATORS = {
+    'sma20': 1,              # 20 days simple moving average of the close
+    'std20': 2,              # 20 days standard deviation of the close
+    'bollinger_upper': 3,    # sma20 + 2 std20
+    'bollinger_lower': 4,    # sma20 - 2 std20
+    'ema20': 5,              # 20 days exponential moving average of the close
+    'rsi14': 6,              # 14 days relative strength index
+    'rsi14_gain': 7,         # Wilder average of the gains, state of rsi14
+    'rsi14_loss': 8,         # Wilder average of the losses, state of rsi14
+}
+# the indicators a computation continues from
+STATE = ['ema20', 'rsi14_gain', 'rsi14_loss']
+
+WINDOW = 20
+RSI_PERIOD = 14
+
+
+def seeded_ewm(values, seeds, alpha):
+    # exponential moving average of each company (values indexed like the rows, sorted by cid
+    # then date), which starts from its seed on the first row when there is one
+    values = values.copy()
+    seeded = ~values['cid'].duplicated() & values['cid'].map(seeds).notna()
+    values.loc[seeded, 'x'] = values.loc[seeded, 'cid'].map(seeds)
+    return values.groupby('cid')['x'].transform(lambda x: x.ewm(alpha=alpha, adjust=False).mean())
+
+
+def compute_indicators(closes, state=None):
+    '''Return the indicators of the new days (date, cid, indicator, value)
+
+    :param closes: date, cid and close of the new days of every company, preceded by
+        its WINDOW - 1 previous days when it has a state
+    :param state: value of the STATE indicators (columns) on the last day before the new
+        ones (index cid, plus a date column), None for a computation of the whole history
+    '''
+    closes = closes.sort_values(['cid', 'date']).reset_index(drop=True)
+    if state is None or state.empty:
+        state = pd.DataFrame({'date': pd.Series(dtype=closes['date'].dtype),
+                              **{name: pd.Series(dtype=float) for name in STATE}})
+    last = closes['cid'].map(state['date'])
+    new = last.isna() | (closes['date'] > last)
+    # the recursive indicators continue from the last old day of the company
+    old = ~new
+    tail = old & ~old.groupby(closes['cid']).shift(-1, fill_value=False)
+    recursive = closes[new | tail]
+
+    grouped = closes.groupby('cid')['close']
+    sma = grouped.rolling(WINDOW).mean().reset_index(level=0, drop=True)
+    std = grouped.rolling(WINDOW).std().reset_index(level=0, drop=True)
+    ema = seeded_ewm(recursive.assign(x=recursive['close']), state['ema20'], 2 / (WINDOW + 1))
+    diff = grouped.diff()[recursive.index]
+    gain = seeded_ewm(recursive.assign(x=diff.clip(lower=0)), state['rsi14_gain'], 1 / RSI_PERIOD)
+    loss = seeded_ewm(recursive.assign(x=(-diff).clip(lower=0)), state['rsi14_loss'], 1 / RSI_PERIOD)
+
+    values = pd.DataFrame({
+        'sma20': sma,
+        'std20': std,
+        'bollinger_upper': sma + 2 * std,
+        'bollinger_lower': sma - 2 * std,
+        'ema20': ema,
+        'rsi14': 100 - 100 / (1 + gain / loss),
+        'rsi14_gain': gain,
+        'rsi14_loss': loss,
+    })[new]
+    values['date'] = closes['date']
+    values['cid'] = closes['cid']
+    df = values.melt(id_vars=['date', 'cid'], var_name='indicator', value_name='value').dropna()
+    df['indicator'] = df['indicator'].map(INDICATORS).astype('int16')
+    return df.sort_values(['cid', 'date', 'indicator']).reset_index(drop=True)
+
+
+def last_state(indicators):
+    '''State of every company on its last day, from its indicators (long format)'''
+    names = {i: name for name, i in INDICATORS.items()}
+    df = indicators[indicators['indicator'].map(names).isin(STATE)]
+    df = df[df['date'] == df.groupby('cid')['date'].transform('max')]
+    state = df.pivot(index='cid', columns='indicator', values='value').rename(columns=names)
+    state['date'] = df.groupby('cid')['date'].max()
+    return state.reindex(columns=['date'] + STATE)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
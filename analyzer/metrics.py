@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+'''
+  Timers and counters of the ingestion, by market and by day.
+
+  Every process records the work of the task it runs in the Metrics object
+  of the module (current), under the market day it is working on (cf day).
+  The task returns them with its result (cf take) and the main process merges
+  them in the RunReport of the run, which prints the progress and is saved as
+  a JSON report at the end.
+
+  The stages are timed exclusively: the time of a stage which pulls its input
+  from a generator does not include the stages of the generator. In a run
+  with several workers the times of the stages are summed over the workers,
+  the phases of the run are wall clock times of the main process.
+
+  >>> m = Metrics()
+  >>> with m.day(7, pd.Timestamp('2020-01-02')):
+  ...     m.add('files', 2)
+  ...     with m.stage('clean'):
+  ...         pass
+  >>> sorted(m.take()[(7, pd.Timestamp('2020-01-02'))])
+  ['clean_seconds', 'files']
+  >>> m.take()
+  {}
+'''
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+class Metrics:
+    """ Stage times and counters of the market days of a process."""
+
+    def __init__(self):
+        self.days = {}  # (mid, day) -> name -> value, the time of a stage is '<stage>_seconds'
+        self.__key = (None, None)
+
+    @contextmanager
+    def day(self, mid, day):
+        '''Record what is done inside under the day of a market'''
+        key, self.__key = self.__key, (mid, day)
+        try:
+            yield
+        finally:
+            self.__key = key
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name + '_seconds', time.perf_counter() - start)
+
+    def timed(self, iterable, name):
+        '''Yield the items of iterable, the time taken to get them counted in the stage name'''
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+
+    def add(self, name, n=1):
+        values = self.days.setdefault(self.__key, {})
+        values[name] = values.get(name, 0) + n
+
+    def take(self):
+        '''Return the metrics recorded since the last call, sent back with the result of a task'''
+        days, self.days = self.days, {}
+        return days
+
+
+# metrics of the task run by this process
+current = Metrics()
+day = current.day
+stage = current.stage
+timed = current.timed
+add = current.add
+take = current.take
+
+
+def sum_values(values):
+    totals = {}
+    for day_values in values:
+        for name, value in day_values.items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+def rounded(values):
+    # plain Python numbers, for json
+    return {name: round(float(value), 6) if isinstance(value, float) else int(value)
+            for name, value in sorted(values.items())}
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class RunReport:
+    """ Metrics of a run of the analyzer, merged from its tasks.
+
+    A progress line (days ingested, rows per second and estimated time left)
+    is printed at most every interval seconds as the days are merged.
+    """
+
+    def __init__(self, interval=30, logger=None):
+        self.interval = interval
+        self.logger = logger
+        self.start = pd.Timestamp.now(tz='UTC')
+        self.days = {}  # (mid, day) -> name -> value
+        self.phases = {}  # name -> seconds
+        self.total_days = 0
+        self.done_days = 0
+        self.__clock = time.perf_counter()
+        self.__last_progress = self.__clock
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.__lock:
+                self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    def expect(self, n_days):
+        '''Count the days to ingest of one more market'''
+        with self.__lock:
+            self.total_days += n_days
+
+    def merge(self, days, n_done=0):
+        '''Add the metrics of a task, which ingested n_done days'''
+        with self.__lock:
+            for key, values in days.items():
+                totals = self.days.setdefault(key, {})
+                for name, value in values.items():
+                    totals[name] = totals.get(name, 0) + value
+            self.done_days += n_done
+            if n_done and time.perf_counter() - self.__last_progress >= self.interval:
+                self.__last_progress = time.perf_counter()
+                self.print_progress()
+
+    def totals(self, mid=None):
+        return sum_values(values for (day_mid, _), values in self.days.items() if mid is None or day_mid == mid)
+
+    def progress(self):
+        elapsed = time.perf_counter() - self.__clock
+        totals = self.totals()
+        left = self.total_days - self.done_days
+        eta = format_duration(elapsed / self.done_days * left) if self.done_days else '?'
+        return ('%d/%d days, %d files, %d rows, %.0f rows/s, %.1f MB/s of bz2, %s elapsed, ETA %s'
+                % (self.done_days, self.total_days, totals.get('files', 0), totals.get('rows_copied_stocks', 0),
+                   totals.get('rows_copied_stocks', 0) / elapsed, totals.get('bytes_compressed', 0) / elapsed / 1e6,
+                   format_duration(elapsed), eta))
+
+    def print_progress(self):
+        line = self.progress()
+        print(line, flush=True)
+        if self.logger is not None:
+            self.logger.info(line)
+
+    def summary(self):
+        '''The stages by decreasing time'''
+        stages = {name[:-len('_seconds')]: value for name, value in self.totals().items() if name.endswith('_seconds')}
+        return ', '.join('%s %.1f s' % (name, seconds) for name, seconds in
+                         sorted(stages.items(), key=lambda stage: -stage[1]))
+
+    def to_dict(self, markets=None):
+        '''The report, markets gives the aliases of every market id'''
+        markets = markets or {}
+        report = {
+            'start': self.start.isoformat(),
+            'end': pd.Timestamp.now(tz='UTC').isoformat(),
+            'seconds': round(time.perf_counter() - self.__clock, 6),
+            'days': {'total': self.total_days, 'done': self.done_days},
+            'phases': rounded(self.phases),
+            'totals': rounded(self.totals()),
+            'markets': {},
+        }
+        for mid in sorted({mid for mid, _ in self.days if mid is not None}):
+            days = sorted(((day, values) for (day_mid, day), values in self.days.items()
+                           if day_mid == mid and day is not None), key=lambda item: item[0])
+            report['markets'][str(mid)] = {
+                'aliases': sorted(markets.get(mid, [])),
+                'totals': rounded(self.totals(mid)),
+                'days': {day.strftime('%Y-%m-%d'): rounded(values) for day, values in days},
+            }
+        return report
+
+    def save(self, filename, markets=None):
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(self.to_dict(markets), f, indent=1)
+        os.replace(filename + '.tmp', filename)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
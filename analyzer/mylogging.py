@@ -8,6 +8,18 @@
   de ne rien mettre dans les autres fichier ainsi il suffit de modifier la valeur
   par défaut ici pour que toute la bibliothèque change le seuil.
 
+  Les messages sont écrits par un thread (cf AsyncHandler) : l'appelant ne fait
+  que les mettre dans une file, sans formatage ni écriture. Les messages de debug
+  d'un même appel (même format, comme 'SQL: %s') sont limités à debug_rate par
+  seconde (cf RateLimitFilter). Il faut passer les arguments au logger plutôt que
+  de formater le message avant, ils ne sont formatés que si le message est écrit.
+
+  Les processus workers (lancés par spawn) n'écrivent pas dans les fichiers : le
+  parent crée une file multiprocessing (cf listen_workers) que chaque worker
+  donne à log_to_queue avant de créer ses loggers. Leurs messages sont écrits
+  par les loggers du parent du même nom, un seul processus écrit et fait tourner
+  chaque fichier.
+
   cf https://docs.python.org/2/howto/logging.html pour la doc
 
   >>> from testfixtures import LogCapture
@@ -15,20 +27,140 @@
   >>> getLogger(__name__, level=logging.DEBUG).error('doctest'); print(l)
   mylogging ERROR
     doctest
+  >>> f = RateLimitFilter(rate=2)
+  >>> [f.filter(logging.makeLogRecord({'msg': 'SQL: %s', 'levelno': DEBUG})) for i in range(4)]
+  [True, True, False, False]
 '''
 
+import atexit
 import logging
 import logging.handlers
+import multiprocessing.util
+import os
+import queue
+import threading
+import time
 
 INFO = logging.INFO
 DEBUG = logging.DEBUG
 
 log_level = logging.DEBUG  # change this if you want a another default variable
+debug_rate = 20  # debug messages of a same call written by second, None for all of them
+worker_queue = None  # file des messages vers le processus parent, dans un worker (cf log_to_queue)
+
+class AsyncHandler(logging.handlers.QueueHandler):
+    '''Handler qui met les messages dans une file, écrits par un thread du processus
+    avec le handler donné. Le thread est démarré au premier message de chaque
+    processus et vide la file à la fin du processus. Les workers de l'analyzer
+    n'en ont pas, ils envoient leurs messages au parent (cf log_to_queue).
+    '''
+
+    def __init__(self, handler):
+        super().__init__(queue.SimpleQueue())
+        self.handler = handler
+        self._pid = None
+        self._listener = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # la file et le thread du processus parent ne servent plus
+            self.queue = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(self.queue, self.handler,
+                                                            respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self.stop)
+            # les workers de multiprocessing ne passent pas par atexit
+            multiprocessing.util.Finalize(None, self.stop, exitpriority=10)
+
+    def stop(self):
+        '''Écrit les messages en attente et arrête le thread'''
+        with self._start_lock:
+            if self._pid == os.getpid() and self._listener is not None:
+                self._listener.stop()
+                self._listener = None
+                self._pid = None
+
+    def prepare(self, record):
+        # le message est formaté par le thread, pas par l'appelant
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        super().enqueue(record)
+
+class RateLimitFilter(logging.Filter):
+    '''Garde au plus rate messages de debug par seconde pour chaque format de
+    message, les messages plus importants passent tous. Le premier message
+    gardé après des messages ignorés en donne le nombre.
+    '''
+
+    def __init__(self, rate=debug_rate):
+        super().__init__()
+        self.rate = rate
+        self._counts = {}  # format -> (seconde, messages gardés, messages ignorés)
+        # les threads de l'analyzer (un par marché) loggent en même temps
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.rate is None or record.levelno > DEBUG:
+            return True
+        key = record.msg
+        second = int(time.monotonic())
+        with self._lock:
+            start, kept, dropped = self._counts.get(key, (second, 0, 0))
+            if start != second:
+                start, kept = second, 0
+            if kept >= self.rate:
+                self._counts[key] = (start, kept, dropped + 1)
+                return False
+            self._counts[key] = (start, kept + 1, 0)
+        if dropped:
+            record.msg = '%s (%d similar messages dropped)' % (record.msg, dropped)
+        return True
+
+class ParentHandler(logging.Handler):
+    '''Passe les messages reçus des workers aux handlers du logger du même nom
+    de ce processus, sans repasser par ses filtres (déjà appliqués par le worker)
+    '''
+
+    def emit(self, record):
+        logging.getLogger(record.name).callHandlers(record)
+
+def listen_workers(context):
+    '''Crée la file des messages des workers du contexte multiprocessing donné et
+    démarre le thread qui les écrit. Renvoie la file, à passer aux workers, et le
+    QueueListener, à arrêter (stop) une fois les workers terminés.
+    '''
+    worker_logs = context.Queue()
+    listener = logging.handlers.QueueListener(worker_logs, ParentHandler())
+    listener.start()
+    return worker_logs, listener
+
+def log_to_queue(worker_logs):
+    '''Dans un worker : les loggers créés ensuite envoient leurs messages au parent
+    par la file de listen_workers au lieu d'écrire eux-mêmes
+    '''
+    global worker_queue
+    worker_queue = worker_logs
 
 def getLogger(name, level=log_level,
-              filename=None, file_level=None):
+              filename=None, file_level=None, rate=debug_rate):
     logger = logging.getLogger(name)
     logger.setLevel(level)
+    if logger.handlers:
+        # already set up, by another instance of the same class
+        return logger
+    if rate is not None:
+        logger.addFilter(RateLimitFilter(rate))
+    if worker_queue is not None:
+        # formaté ici (prepare), le message est écrit par le parent
+        logger.addHandler(logging.handlers.QueueHandler(worker_queue))
+        return logger
     # create formatter
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     # create file handle if needed
@@ -40,14 +172,12 @@ def getLogger(name, level=log_level,
         else:
             fh.setLevel(file_level)
         fh.setFormatter(formatter)
-        logger.addHandler(fh)
+        logger.addHandler(AsyncHandler(fh))
     else:
         # create console handler and set level to debug
         sh = logging.StreamHandler()
         sh.set_name("handler of %s" % name)
         sh.setLevel(level)
         sh.setFormatter(formatter)
-        logger.addHandler(sh)
+        logger.addHandler(AsyncHandler(sh))
     return logger
-
-
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+'''
+  Columnar cache of the Boursorama snapshots.
+
+  The bz2 pickles are decompressed once and stored as NumPy arrays, one
+  directory per market and day:
+
+    <root>/<mid>/symbols.npy        dictionary of the symbols of the market
+    <root>/<mid>/<YYYYMMDD>/
+        paths.npy                   source files of the day, to detect new ones
+        times.npy        int64      timestamp (ns) of each snapshot
+        offsets.npy      int64      first row of each snapshot, plus the row count
+        symbol.npy       int32      code of the symbol of each cleaned row
+        last.npy         float32    price of each cleaned row
+        volume.npy       int64      volume of each cleaned row
+        companies.npy    int32      codes of the symbols of the last snapshot of the day
+        names.npy                   names of the companies of the last snapshot
+
+  The rows are the ones kept by analyzer.clean_df. The arrays are memory mapped
+  when read, so a market day costs no decompression and no copy to load.
+'''
+
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+
+class SnapshotCache:
+    """ Snapshots of every market day, stored as memory mapped columns."""
+
+    def __init__(self, root):
+        self.root = root
+        self.__symbols = {}  # symbol dictionary of each market
+
+    def day_dir(self, mid, day):
+        return os.path.join(self.root, str(mid), day.strftime('%Y%m%d'))
+
+    def is_cached(self, mid, day, paths):
+        '''
+        Check if a day is cached with exactly these source files
+        '''
+        filename = os.path.join(self.day_dir(mid, day), 'paths.npy')
+        return os.path.exists(filename) and np.load(filename).tolist() == list(paths)
+
+    # symbol dictionary
+
+    def symbols(self, mid):
+        if mid not in self.__symbols:
+            filename = os.path.join(self.root, str(mid), 'symbols.npy')
+            self.__symbols[mid] = np.load(filename) if os.path.exists(filename) else np.array([], dtype=str)
+        return self.__symbols[mid]
+
+    def encode(self, mid, symbols):
+        '''
+        Return the codes of symbols, adding the unknown ones to the dictionary
+        of the market. The dictionary only grows so the codes of the cached
+        days stay valid.
+        '''
+        dictionary = pd.Index(self.symbols(mid))
+        codes = dictionary.get_indexer(symbols)
+        if (codes < 0).any():
+            new = pd.unique(np.asarray(symbols)[codes < 0])
+            dictionary = dictionary.append(pd.Index(new))
+            self.__symbols[mid] = dictionary.to_numpy(dtype=str)
+            self.__save(os.path.join(self.root, str(mid), 'symbols.npy'), self.__symbols[mid])
+            codes = dictionary.get_indexer(symbols)
+        return codes.astype('int32')
+
+    def __save(self, filename, array):
+        # write then rename, a crash never leaves a truncated file
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        np.save(filename + '.tmp.npy', array)
+        os.replace(filename + '.tmp.npy', filename)
+
+    # days
+
+    def write_day(self, mid, day, paths, times, offsets, symbols, last, volume, companies, names):
+        '''
+        Store one market day. The day is written in a temporary directory
+        which replaces the previous version of the day once complete.
+        '''
+        columns = {
+            'paths': np.asarray(paths, dtype=str),
+            'times': np.asarray(times, dtype='int64'),
+            'offsets': np.asarray(offsets, dtype='int64'),
+            'symbol': self.encode(mid, symbols),
+            'last': np.asarray(last, dtype='float32'),
+            'volume': np.asarray(volume, dtype='int64'),
+            'companies': self.encode(mid, companies),
+            'names': np.asarray(names, dtype=str),
+        }
+        directory = self.day_dir(mid, day)
+        tmp = directory + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, array in columns.items():
+            np.save(os.path.join(tmp, name + '.npy'), array)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp, directory)
+
+    def read_day(self, mid, day):
+        '''
+        Return the columns of a market day, memory mapped
+        '''
+        directory = self.day_dir(mid, day)
+        return {name[:-4]: np.load(os.path.join(directory, name), mmap_mode='r')
+                for name in os.listdir(directory)}
+
+    def iter_snapshots(self, mid, day):
+        '''
+        Yield the snapshots of a day as clean_df would return them: indexed by
+        symbol with the last and volume columns
+        '''
+        columns = self.read_day(mid, day)
+        symbols = self.symbols(mid)
+        offsets = columns['offsets']
+        for start, stop in zip(offsets[:-1], offsets[1:]):
+            yield pd.DataFrame({'last': columns['last'][start:stop],
+                                'volume': columns['volume'][start:stop]},
+                               index=symbols[columns['symbol'][start:stop]])
+
+    def companies(self, mid, day):
+        '''
+        Return the names of the companies of the last snapshot of a day, indexed by symbol
+        '''
+        columns = self.read_day(mid, day)
+        return pd.DataFrame({'name': columns['names']}, index=self.symbols(mid)[columns['companies']])
@@ -10,16 +10,79 @@ from io import StringIO
 
 
 import mylogging
+from binary_copy import BinaryCopyReader, TABLE_TYPES, CHUNKSIZE
+from indicators import INDICATORS, STATE
+
+# Chunks of the hypertables. stocks gets about 50 000 rows a market day (a snapshot
+# every 10 minutes of about 1000 companies), 4 weeks are ~1M rows, ~50 MB before
+# compression. daystocks is 50 times smaller, one chunk a year.
+STOCKS_CHUNK_INTERVAL = '4 weeks'
+DAYSTOCKS_CHUNK_INTERVAL = '52 weeks'
+# chunks are compressed once no snapshot is expected in them any more, by policies
+# added after the load (see add_compression_policies)
+STOCKS_COMPRESS_AFTER = '8 weeks'
+DAYSTOCKS_COMPRESS_AFTER = '52 weeks'
+COMPRESS_AFTER = {'stocks': STOCKS_COMPRESS_AFTER, 'daystocks': DAYSTOCKS_COMPRESS_AFTER,
+                  'indicators': DAYSTOCKS_COMPRESS_AFTER}
+# rows read at once by the server-side cursors of stream_df
+STREAM_FETCH_SIZE = 50000
+# type oids of the timestamps, converted to datetime64 columns
+TIMESTAMP_OIDS = (1114, 1184)
+
+
+def rows_to_df(rows, description, coerce_float=True):
+    '''Return a dataframe of NumPy columns from the rows of a psycopg2 cursor, the
+    timestamps as datetime64 (in UTC for the timestamptz). With coerce_float the
+    decimals are converted to floats
+
+    >>> from collections import namedtuple
+    >>> Column = namedtuple('Column', 'name type_code')
+    >>> rows_to_df([(1, 2.5), (2, None)], [Column('cid', 21), Column('value', 700)]).dtypes.tolist()
+    [dtype('int64'), dtype('float64')]
+    '''
+    names = [column.name for column in description]
+    if not rows:
+        return pd.DataFrame(columns=names)
+    df = pd.DataFrame.from_records(rows, columns=names, coerce_float=coerce_float)
+    for i, column in enumerate(description):
+        if column.type_code in TIMESTAMP_OIDS:
+            df.isetitem(i, pd.to_datetime(df.iloc[:, i], utc=column.type_code == 1184))
+    return df
+
+
+def parse_date_columns(df, parse_dates):
+    '''Convert the columns of a dataframe to dates, as the parse_dates of pandas.read_sql:
+    a list of columns, or a dict of column -> format or arguments of pandas.to_datetime
+
+    >>> df = parse_date_columns(pd.DataFrame({'day': ['20200102'], 'time': [0]}), {'day': '%Y%m%d', 'time': {'unit': 's'}})
+    >>> df.iloc[0].tolist()
+    [Timestamp('2020-01-02 00:00:00'), Timestamp('1970-01-01 00:00:00')]
+    '''
+    if isinstance(parse_dates, str):
+        parse_dates = [parse_dates]
+    if not isinstance(parse_dates, dict):
+        parse_dates = dict.fromkeys(parse_dates)
+    for column, how in parse_dates.items():
+        kwargs = how if isinstance(how, dict) else {'format': how}
+        df[column] = pd.to_datetime(df[column], **kwargs)
+    return df
+
 
 class TimescaleStockMarketModel:
     """ Bourse model with TimeScaleDB persistence."""
 
-    def __init__(self, database, user=None, host=None, password=None, port=None):
+    def __init__(self, database, user=None, host=None, password=None, port=None, setup=True,
+                 aggregate=False):
         """Create a TimescaleStockMarketModel
 
         database -- The name of the persistence database.
         user     -- Username to connect with to the database. Same as the
                     database name by default.
+        setup    -- Create the tables. Ingestion workers connect to a database
+                    which is already set up and skip it.
+        aggregate -- On a new database, create daystocks as a continuous
+                    aggregate of stocks instead of a table written by the
+                    analyzer.
 
         """
 
@@ -39,12 +102,15 @@ class TimescaleStockMarketModel:
         self.__nf_cid = {}  # cid from netfonds symbol
         self.__boursorama_cid = {}  # cid from netfonds symbol
         self.__market_id = {}  # id of markets from aliases
+        self.__timezone = None  # timezone of the session, for the binary COPY of naive dates
+        self.__daystocks_aggregate = None  # daystocks is a continuous aggregate
 
-        self.logger.info("Setup database generates an error if it exists already, it's ok")
-        self._setup_database()
+        if setup:
+            self.logger.info("Setup database generates an error if it exists already, it's ok")
+            self._setup_database(aggregate)
 
 
-    def _setup_database(self):
+    def _setup_database(self, aggregate=False):
         try:
             # Create the tables if they do not exist.
             #
@@ -85,20 +151,12 @@ class TimescaleStockMarketModel:
                   value FLOAT4,
                   volume BIGINT
                 );''')
-            cursor.execute('''SELECT create_hypertable('stocks', by_range('date'));''')
+            cursor.execute('''SELECT create_hypertable('stocks', by_range('date', INTERVAL '%s'));'''
+                           % STOCKS_CHUNK_INTERVAL)
             cursor.execute('''CREATE INDEX idx_cid_stocks ON stocks (cid, date DESC);''')
-            cursor.execute(
-                '''CREATE TABLE daystocks (
-                  date TIMESTAMPTZ,
-                  cid SMALLINT,
-                  open FLOAT4,
-                  close FLOAT4,
-                  high FLOAT4,
-                  low FLOAT4,
-                  volume BIGINT
-                );''')
-            cursor.execute('''SELECT create_hypertable('daystocks', by_range('date'));''')
-            cursor.execute('''CREATE INDEX idx_cid_daystocks ON daystocks (cid, date DESC);''')
+            self._compress(cursor, 'stocks')
+            if not aggregate:
+                self._create_daystocks_table(cursor)
             cursor.execute(
                 '''CREATE TABLE file_done (
                   name VARCHAR PRIMARY KEY
@@ -122,16 +180,264 @@ class TimescaleStockMarketModel:
         except Exception as e:
             self.logger.exception('SQL error: %s' % e)
         self.__connection.commit()
+        # other aliases of the markets, the file prefix of the snapshots when it is not
+        # the alias of the market. A new market is ingested once inserted in markets
+        # or here, without code change.
+        cursor = self.__connection.cursor()
+        cursor.execute(
+            '''CREATE TABLE IF NOT EXISTS market_aliases (
+              alias VARCHAR PRIMARY KEY,
+              mid SMALLINT
+            );''')
+        cursor.execute("INSERT INTO market_aliases (alias, mid) VALUES ('peapme', 1) ON CONFLICT DO NOTHING;")
+        # first close of every company and year (UTC), the baseline of the YTD of the dashboard
+        cursor.execute(
+            '''CREATE TABLE IF NOT EXISTS ytd_baselines (
+              cid SMALLINT,
+              year SMALLINT,
+              date TIMESTAMPTZ,
+              close FLOAT4,
+              PRIMARY KEY (cid, year)
+            );''')
+        self.__connection.commit()
+        self._setup_indicators()
+        if aggregate:
+            self.create_daystocks_aggregate()
+        self.create_yearstocks_aggregate()
+
+    def _setup_indicators(self):
+        # technical indicators of the daystocks (see indicators.py), one row per
+        # company, day and indicator
+        cursor = self.__connection.cursor()
+        cursor.execute(
+            '''CREATE TABLE IF NOT EXISTS indicator_names (
+              id SMALLINT PRIMARY KEY,
+              name VARCHAR
+            );''')
+        for name, i in INDICATORS.items():
+            cursor.execute("INSERT INTO indicator_names (id, name) VALUES (%s, %s) ON CONFLICT DO NOTHING;",
+                           (i, name))
+        cursor.execute("SELECT to_regclass('indicators');")
+        exists = cursor.fetchone()[0] is not None
+        cursor.execute(
+            '''CREATE TABLE IF NOT EXISTS indicators (
+              date TIMESTAMPTZ,
+              cid SMALLINT,
+              indicator SMALLINT,
+              value FLOAT4
+            );''')
+        cursor.execute('''CREATE INDEX IF NOT EXISTS idx_cid_indicators ON indicators (cid, indicator, date DESC);''')
+        self.__connection.commit()
+        if exists:
+            return
+        try:
+            cursor.execute('''SELECT create_hypertable('indicators', by_range('date', INTERVAL '%s'));'''
+                           % DAYSTOCKS_CHUNK_INTERVAL)
+            self._compress(cursor, 'indicators', segmentby='cid, indicator')
+            self.__connection.commit()
+        except Exception as e:
+            self.logger.exception('SQL error: %s' % e)
+            self.__connection.rollback()
+
+    def _create_daystocks_table(self, cursor):
+        cursor.execute(
+            '''CREATE TABLE daystocks (
+              date TIMESTAMPTZ,
+              cid SMALLINT,
+              open FLOAT4,
+              close FLOAT4,
+              high FLOAT4,
+              low FLOAT4,
+              volume BIGINT
+            );''')
+        cursor.execute('''SELECT create_hypertable('daystocks', by_range('date', INTERVAL '%s'));'''
+                       % DAYSTOCKS_CHUNK_INTERVAL)
+        cursor.execute('''CREATE INDEX idx_cid_daystocks ON daystocks (cid, date DESC);''')
+        self._compress(cursor, 'daystocks')
+
+    def _compress(self, cursor, table, segmentby='cid'):
+        # native compression: the rows of a chunk are stored by segmentby (the
+        # company, and the indicator for the indicators), in columns sorted by
+        # date, as the dashboard reads them. The policy is only added after the
+        # load, the backfill must not write in compressed chunks
+        cursor.execute(
+            '''ALTER TABLE %s SET (
+              timescaledb.compress,
+              timescaledb.compress_segmentby = '%s',
+              timescaledb.compress_orderby = 'date DESC'
+            );''' % (table, segmentby))
+
+    def _has_timescaledb(self):
+        return self.raw_query("SELECT to_regclass('timescaledb_information.hypertables');")[0][0] is not None
+
+    def add_compression_policies(self):
+        '''
+        Add the compression policies of the hypertables with compression
+        enabled, once the data are loaded: chunks older than COMPRESS_AFTER
+        are then compressed in the background. Nothing is done for the
+        policies which exist already
+        '''
+        if not self._has_timescaledb():
+            return
+        tables = self.raw_query("SELECT hypertable_name FROM timescaledb_information.hypertables "
+                                "WHERE compression_enabled AND hypertable_name = ANY(%s);", (list(COMPRESS_AFTER),))
+        for table, in tables:
+            self.execute("SELECT add_compression_policy(%s, %s::interval, if_not_exists => true);",
+                         (table, COMPRESS_AFTER[table]))
+        self.commit()
+
+    def _decompress_day(self, table, date):
+        # decompress the chunks of a hypertable holding a day, so that its rows can be
+        # deleted and written again. The compression policy compresses them later
+        if not self._has_timescaledb():
+            return
+        self.execute(
+            '''SELECT decompress_chunk((quote_ident(chunk_schema) || '.' || quote_ident(chunk_name))::regclass, true)
+            FROM timescaledb_information.chunks
+            WHERE hypertable_name = %s AND is_compressed
+              AND range_start < %s + INTERVAL '1 day' AND range_end > %s;''', (table, date, date))
+
+    def create_daystocks_aggregate(self):
+        '''
+        Create daystocks as a continuous aggregate of stocks: the daily
+        open/close/high/low/volume are computed by TimescaleDB when stocks
+        change, the analyzer only writes stocks. Days are cut at midnight in
+        the timezone of the session, as the dates written by the analyzer.
+        If it cannot be created (no TimescaleDB) daystocks is created as a
+        table, written by the analyzer.
+        '''
+        timezone = self.raw_query("SHOW timezone;")[0][0]
+        self.__connection.commit()
+        # continuous aggregates cannot be created or refreshed in a transaction
+        self.__connection.autocommit = True
+        cursor = self.__connection.cursor()
+        try:
+            cursor.execute(
+                '''CREATE MATERIALIZED VIEW IF NOT EXISTS daystocks
+                WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+                SELECT time_bucket(INTERVAL '1 day', date, %s) AS date,
+                  cid,
+                  first(value, date) AS open,
+                  last(value, date) AS close,
+                  max(value) AS high,
+                  min(value) AS low,
+                  max(volume) AS volume
+                FROM stocks
+                GROUP BY 1, cid
+                WITH NO DATA;''', (timezone,))
+            cursor.execute('''CREATE INDEX IF NOT EXISTS idx_cid_daystocks ON daystocks (cid, date DESC);''')
+            # late ticks invalidate their days, which the policy materializes again
+            cursor.execute(
+                '''SELECT add_continuous_aggregate_policy('daystocks',
+                  start_offset => NULL, end_offset => NULL,
+                  schedule_interval => INTERVAL '1 hour', if_not_exists => true);''')
+        except Exception as e:
+            self.logger.exception('SQL error, daystocks is written by the analyzer: %s' % e)
+            try:
+                self._create_daystocks_table(cursor)
+            except Exception as e:
+                self.logger.exception('SQL error: %s' % e)
+        finally:
+            self.__connection.autocommit = False
+        self.__daystocks_aggregate = None
+
+    def create_yearstocks_aggregate(self):
+        '''
+        Create yearstocks, the yearly open/close/high/low of every company with
+        its traded volume and the highest and lowest volume of its days, for the
+        market statistics of the dashboard. It is a continuous aggregate of
+        daystocks (years cut in the timezone of the session), or a plain view if
+        it cannot be created.
+        '''
+        if self.raw_query("SELECT to_regclass('yearstocks');")[0][0] is not None:
+            return
+        timezone = self.raw_query("SHOW timezone;")[0][0]
+        self.__connection.commit()
+        # continuous aggregates cannot be created in a transaction
+        self.__connection.autocommit = True
+        cursor = self.__connection.cursor()
+        columns = '''cid,
+                  first(open, date) AS open,
+                  last(close, date) AS close,
+                  max(high) AS high,
+                  min(low) AS low,
+                  sum(volume) AS volume,
+                  max(volume) AS max_volume,
+                  min(volume) AS min_volume
+                FROM daystocks
+                GROUP BY 1, cid'''
+        try:
+            cursor.execute(
+                '''CREATE MATERIALIZED VIEW yearstocks
+                WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+                SELECT time_bucket(INTERVAL '1 year', date, %s) AS year,
+                  ''' + columns + '''
+                WITH NO DATA;''', (timezone,))
+            cursor.execute(
+                '''SELECT add_continuous_aggregate_policy('yearstocks',
+                  start_offset => NULL, end_offset => NULL,
+                  schedule_interval => INTERVAL '1 day', if_not_exists => true);''')
+        except Exception as e:
+            self.logger.exception('SQL error, yearstocks is a view: %s' % e)
+            try:
+                cursor.execute(
+                    '''CREATE VIEW yearstocks AS
+                    SELECT date_trunc('year', date) AS year,
+                      ''' + columns + ';')
+            except Exception as e:
+                self.logger.exception('SQL error: %s' % e)
+        finally:
+            self.__connection.autocommit = False
+
+    def is_continuous_aggregate(self, view):
+        '''
+        Check if a view is a continuous aggregate
+        '''
+        if self.raw_query("SELECT to_regclass('timescaledb_information.continuous_aggregates');")[0][0] is None:
+            return False
+        return bool(self.raw_query(
+            "SELECT 1 FROM timescaledb_information.continuous_aggregates WHERE view_name = %s;", (view,)))
+
+    def is_daystocks_aggregate(self):
+        '''
+        Check if daystocks is a continuous aggregate (a view) rather than a table
+        '''
+        if self.__daystocks_aggregate is None:
+            rows = self.raw_query("SELECT relkind FROM pg_class WHERE relname = 'daystocks';")
+            self.__daystocks_aggregate = bool(rows) and rows[0][0] == 'v'
+        return self.__daystocks_aggregate
+
+    def refresh_daystocks(self, start=None, end=None):
+        '''
+        Materialize the days of the daystocks aggregate changed between start
+        and end (all the days by default), after a bulk load of stocks
+        '''
+        self.refresh_aggregate('daystocks', start, end)
+
+    def refresh_aggregate(self, view, start=None, end=None):
+        '''
+        Materialize the buckets of a continuous aggregate changed between start
+        and end (all the buckets by default)
+        '''
+        self.commit()
+        self.__connection.autocommit = True
+        try:
+            self.execute("CALL refresh_continuous_aggregate(%s, %s, %s);", (view, start, end))
+        finally:
+            self.__connection.autocommit = False
 
     # ------------------------------ public methods --------------------------------
 
-    def execute(self, query, args=None, cursor=None, commit=False):
-        """Send a Postgres SQL command. No return"""
+    def log_query(self, what, query, args=None):
+        """Debug log of a query, formatted only if it is written (see mylogging)"""
         if args is None:
-            pretty = query
+            self.logger.debug('%s: %s', what, query)
         else:
-            pretty = '%s %% %r' % (query, args)
-        self.logger.debug('SQL: QUERY: %s' % pretty)
+            self.logger.debug('%s: %s %% %r', what, query, args)
+
+    def execute(self, query, args=None, cursor=None, commit=False):
+        """Send a Postgres SQL command. No return"""
+        self.log_query('SQL: QUERY', query, args)
         if cursor is None:
             cursor = self.__connection.cursor()
         cursor.execute(query, args)
@@ -163,11 +469,7 @@ class TimescaleStockMarketModel:
 
     def raw_query(self, query, args=None, cursor=None):
         """Return a tuple from a Postgres SQL query"""
-        if args is None:
-            pretty = query
-        else:
-            pretty = '%s %% %r' % (query, args)
-        self.logger.debug('SQL: QUERY: %s' % pretty)
+        self.log_query('SQL: QUERY', query, args)
         if cursor is None:
             cursor = self.__connection.cursor()
         cursor.execute(query, args)
@@ -180,15 +482,79 @@ class TimescaleStockMarketModel:
         :param query:
         :param args: arguments for the query
         :param other args: see https://pandas.pydata.org/pandas-docs/stable/reference/api/pandas.read_sql.html
-        :return: a dataframe
+        :return: a dataframe, or with chunksize an iterator of dataframes of chunksize rows,
+                 coerce_float, parse_dates, columns, index_col and dtype applied to each
         '''
         if args is not None:
             query = query % args
-        self.logger.debug('df_query: %s' % query)
+        self.log_query('df_query', query, params)
+        if chunksize is not None:
+            # batches read by a server-side cursor, pandas would fetch all the rows first
+            batches = self.stream_df(query, params, fetch_size=chunksize, coerce_float=coerce_float)
+            if parse_dates is not None:
+                batches = (parse_date_columns(df, parse_dates) for df in batches)
+            if columns is not None:
+                batches = (df[columns] for df in batches)
+            if index_col is not None:
+                batches = (df.set_index(index_col) for df in batches)
+            if dtype is not None:
+                batches = (df.astype(dtype) for df in batches)
+            return batches
         return pd.read_sql(query, self.__engine, index_col=index_col, coerce_float=coerce_float, 
                            params=params, parse_dates=parse_dates, columns=columns, 
                            chunksize=chunksize, dtype=dtype)
 
+    def fetch_df(self, query, params=None):
+        '''Returns a Pandas dataframe from a small Postgres SQL query (lookups), read at
+        once on the connection of the model, in its transaction
+
+        :param params: parameters of the query (%s or %(name)s placeholders)
+        '''
+        self.log_query('fetch_df', query, params)
+        with self.__connection.cursor() as cursor:
+            cursor.execute(query, params)
+            return rows_to_df(cursor.fetchall(), cursor.description)
+
+    def stream_df(self, query, params=None, fetch_size=STREAM_FETCH_SIZE, coerce_float=True):
+        '''Yields the result of a Postgres SQL query by Pandas dataframes of fetch_size rows
+
+        The rows are read with a server-side cursor, in a read-only transaction
+        of a connection of its own (closed at the end of the iteration), so the
+        memory used does not depend on the size of the result and the model can
+        write and commit meanwhile.
+
+        :param params: parameters of the query (%s or %(name)s placeholders)
+        :param fetch_size: rows of each dataframe
+        :param coerce_float: convert the decimals to floats
+        '''
+        self.log_query('stream_df', query, params)
+        connection = psycopg2.connect(database=self.__database, user=self.__user, host=self.__host,
+                                      port=self.__port, password=self.__password)
+        try:
+            connection.set_session(readonly=True)
+            with connection.cursor(name='stream_df') as cursor:
+                cursor.itersize = fetch_size
+                cursor.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(fetch_size)
+                    if not rows:
+                        break
+                    yield rows_to_df(rows, cursor.description, coerce_float)
+        finally:
+            connection.close()
+
+    def stream_stocks(self, start=None, end=None, cids=None, fetch_size=STREAM_FETCH_SIZE):
+        '''Yields the stocks between two dates (all by default) of some companies (all
+        by default) by dataframes of fetch_size rows, ordered by date, for the
+        exports and the reprocessing of the whole table
+        '''
+        query = 'SELECT * FROM stocks WHERE date >= %(start)s AND date < %(end)s'
+        if cids is not None:
+            query += ' AND cid = ANY(%(cids)s)'
+        params = {'start': '-infinity' if start is None else start, 'end': 'infinity' if end is None else end,
+                  'cids': None if cids is None else [int(cid) for cid in cids]}
+        return self.stream_df(query + ' ORDER BY date;', params, fetch_size)
+
     # system methods
 
     def commit(self):
@@ -237,6 +603,8 @@ class TimescaleStockMarketModel:
 
     # write a dataframe to the database using the optimized copy_from method    
     def df_write_optimized(self, df, table, commit=False):
+        if table in TABLE_TYPES:
+            return self.df_write_binary(df, table, commit=commit)
         sio = StringIO()
         df.to_csv(sio, sep='\t', header=False, index=False)
         sio.seek(0)
@@ -245,12 +613,161 @@ class TimescaleStockMarketModel:
             if commit:
                 self.commit()
 
-    def is_file_done(name):
+    def df_write_binary(self, df, table, types=None, commit=False, chunksize=CHUNKSIZE):
+        '''Write a dataframe with the binary COPY format, see binary_copy.py
+
+        :param types: postgres type of every column, the one of TABLE_TYPES by default
+        :param chunksize: number of rows encoded and sent at once
+        '''
+        if self.__timezone is None:
+            self.__timezone = self.raw_query("SHOW timezone;")[0][0]
+        types = types or TABLE_TYPES[table]
+        reader = BinaryCopyReader(df, types, self.__timezone, chunksize)
+        query = 'COPY %s (%s) FROM STDIN WITH (FORMAT binary)' % (table, ', '.join(df.columns))
+        with self.__connection.cursor() as cursor:
+            cursor.copy_expert(query, reader, size=1024 * 1024)
+            if commit:
+                self.commit()
+
+    def get_storage_stats(self):
+        '''
+        Return the chunks and compression statistics of the hypertables: number
+        of chunks and of compressed chunks, size on disk, and size of the
+        compressed chunks before and after their compression (bytes)
+        '''
+        return self.fetch_df(
+            '''SELECT h.hypertable_name,
+              (SELECT count(*) FROM timescaledb_information.chunks c
+               WHERE c.hypertable_name = h.hypertable_name) AS chunks,
+              (SELECT count(*) FROM timescaledb_information.chunks c
+               WHERE c.hypertable_name = h.hypertable_name AND c.is_compressed) AS compressed_chunks,
+              hypertable_size(h.relation) AS total_bytes,
+              s.before_compression_total_bytes,
+              s.after_compression_total_bytes
+            FROM (SELECT hypertable_name,
+                    (quote_ident(hypertable_schema) || '.' || quote_ident(hypertable_name))::regclass AS relation
+                  FROM timescaledb_information.hypertables) h
+            LEFT JOIN LATERAL hypertable_compression_stats(h.relation) s ON true
+            ORDER BY h.hypertable_name;''')
+
+    def set_tag(self, name, value, commit=False):
+        '''
+        Set a value of the tags table, read by the dashboard (last_ingestion)
+        '''
+        self.execute("INSERT INTO tags (name, value) VALUES (%s, %s) "
+                     "ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value;", (name, value), commit=commit)
+
+    def get_market_ids(self):
+        '''
+        Return the id of every market from its aliases
+        '''
+        rows = self.raw_query("SELECT alias, id FROM markets UNION SELECT alias, mid FROM market_aliases;")
+        self.__market_id = {alias: mid for alias, mid in rows if alias is not None}
+        return dict(self.__market_id)
+
+    def is_file_done(self, name):
         '''
         Check if a file has already been included in the DB
         '''
-        return self.raw_query("SELECT EXISTS ( SELECT 1 FROM file_done WHERE name = '%s' );" % name)
-        
+        return self.raw_query("SELECT EXISTS ( SELECT 1 FROM file_done WHERE name = %s );", (name,))[0][0]
+
+    def get_files_done(self):
+        '''
+        Return the set of the files already included in the DB
+        '''
+        return {name for name, in self.raw_query("SELECT name FROM file_done;")}
+
+    def set_files_done(self, names, commit=False):
+        '''
+        Record files as included in the DB. Done in the transaction which
+        writes their data so that a crash never leaves a file half recorded.
+        '''
+        self.df_write_optimized(pd.DataFrame({'name': names}), table="file_done", commit=commit)
+
+    def get_company_ids(self):
+        '''
+        Return the ids of all the companies, in increasing order
+        '''
+        return [cid for cid, in self.raw_query("SELECT id FROM companies ORDER BY id;")]
+
+    def get_indicator_input(self, since=None, previous=19, cids=None):
+        '''
+        Return what the indicators of the days not computed yet need, for every company
+        (of cids, all by default): its daystocks after its last day with indicators
+        before since (all of them if since is None), preceded by the previous days
+        before it, and the value of the STATE indicators on this last day (see
+        indicators.compute_indicators)
+        '''
+        last = '''WITH last AS (
+              SELECT c.id AS cid, l.date FROM companies c
+              LEFT JOIN LATERAL (
+                SELECT date FROM indicators
+                WHERE cid = c.id AND indicator = %(ema)s AND date < %(since)s
+                ORDER BY date DESC LIMIT 1) l ON true
+              WHERE %(cids)s IS NULL OR c.id = ANY(%(cids)s))'''
+        params = {'ema': INDICATORS['ema20'], 'since': 'infinity' if since is None else since,
+                  'state': [INDICATORS[name] for name in STATE], 'previous': previous,
+                  'cids': None if cids is None else [int(cid) for cid in cids]}
+        closes = self.fetch_df(last + '''
+            SELECT d.date, last.cid, d.close FROM last
+            CROSS JOIN LATERAL (
+              (SELECT date, close FROM daystocks WHERE cid = last.cid AND date <= last.date
+               ORDER BY date DESC LIMIT %(previous)s)
+              UNION ALL
+              (SELECT date, close FROM daystocks WHERE cid = last.cid AND (last.date IS NULL OR date > last.date))
+            ) d;''', params)
+        state = self.fetch_df(last + '''
+            SELECT last.cid, last.date, i.indicator, i.value FROM last
+            JOIN indicators i ON i.cid = last.cid AND i.date = last.date AND i.indicator = ANY(%(state)s);''',
+            params)
+        names = {i: name for name, i in INDICATORS.items()}
+        state = state.pivot(index='cid', columns='indicator', values='value').rename(columns=names).join(
+            state.groupby('cid')['date'].first())
+        return closes, state.reindex(columns=['date'] + STATE)
+
+    def update_ytd_baselines(self, since=None, commit=False):
+        '''
+        Set the first close of every company for the years from the one of since
+        (all the years if None) from the daystocks. The years are cut in the
+        timezone of the session, as the ones of yearstocks
+        '''
+        self.execute(
+            '''INSERT INTO ytd_baselines (cid, year, date, close)
+            SELECT DISTINCT ON (cid, EXTRACT(year FROM date))
+              cid, EXTRACT(year FROM date), date, close
+            FROM daystocks
+            WHERE date >= date_trunc('year', %s::timestamptz)
+            ORDER BY cid, EXTRACT(year FROM date), date
+            ON CONFLICT (cid, year) DO UPDATE SET date = EXCLUDED.date, close = EXCLUDED.close;''',
+            ('-infinity' if since is None else since,), commit=commit)
+
+    def delete_indicators(self, since, commit=False):
+        '''
+        Remove the indicators from a day on, before they are computed again
+        '''
+        self.execute("DELETE FROM indicators WHERE date >= %s;", (since,), commit=commit)
+
+    def get_daystocks(self, date, cids):
+        '''
+        Return the daystocks of some companies for one day
+        '''
+        return self.fetch_df("SELECT * FROM daystocks WHERE date = %(date)s AND cid = ANY(%(cids)s);",
+                             {'date': date, 'cids': [int(cid) for cid in cids]})
+
+    def delete_day(self, date, cids, files, commit=False):
+        '''
+        Remove the stocks and daystocks of some companies for one day and
+        the file_done records of the day files, before the day is written again.
+        A daystocks aggregate follows the deletion in stocks by itself.
+        The compressed chunks of the day are decompressed first.
+        '''
+        self._decompress_day('stocks', date)
+        self.execute("DELETE FROM stocks WHERE date >= %s AND date < %s + INTERVAL '1 day' AND cid = ANY(%s);",
+                     (date, date, cids))
+        if not self.is_daystocks_aggregate():
+            self._decompress_day('daystocks', date)
+            self.execute("DELETE FROM daystocks WHERE date = %s AND cid = ANY(%s);", (date, cids))
+        self.execute("DELETE FROM file_done WHERE name = ANY(%s);", (files,), commit=commit)
 
 
 #
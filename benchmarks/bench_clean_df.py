@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+'''
+  Benchmark of analyzer.clean_df against the original regex implementation,
+  on snapshots shaped like the Boursorama ones.
+
+  python3 benchmarks/bench_clean_df.py [--repeat 50]
+'''
+
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'analyzer'))
+from analyzer import clean_df
+
+
+def clean_df_regex(df):
+    # the original implementation, the reference for the results
+    df = df.dropna()
+    df = df.drop(columns=['symbol', 'name'])
+    df['last'] = df['last'].astype(str).str.replace(r'\([cs]\)', '', regex=True).replace(r' ', '', regex=True)
+    df['last'] = df['last'].astype(float)
+    df['volume'] = df['volume'].astype(int)
+    df = df[df['volume'] != 0]
+    return df
+
+
+def make_snapshot(n, numeric=False, seed=0):
+    # n companies, prices with (c)/(s) suffixes and thousands separators,
+    # a few missing values and untraded companies
+    rng = np.random.default_rng(seed)
+    prices = np.round(rng.lognormal(3, 1.5, n), 2)
+    if numeric:
+        last = prices
+    else:
+        suffix = rng.choice(['', '(c)', '(s)'], n, p=[0.6, 0.3, 0.1])
+        last = np.array(['{:,.2f}'.format(p).replace(',', ' ') + s for p, s in zip(prices, suffix)], dtype=object)
+        last[rng.random(n) < 0.01] = None
+    volume = rng.integers(0, 100000, n).astype(float)
+    volume[rng.random(n) < 0.2] = 0
+    symbols = ['1rP%05d' % i for i in range(n)]
+    return pd.DataFrame({'symbol': symbols, 'name': ['Company %d' % i for i in range(n)],
+                         'last': last, 'volume': volume}, index=symbols)
+
+
+def bench(repeat):
+    print('%-8s %-8s %12s %12s %8s' % ('rows', 'last', 'regex (ms)', 'new (ms)', 'speedup'))
+    for n in [250, 1000, 5000, 20000]:
+        for numeric in [False, True]:
+            df = make_snapshot(n, numeric)
+            pd.testing.assert_frame_equal(clean_df_regex(df)[['last', 'volume']], clean_df(df))
+            old = min(timeit.repeat(lambda: clean_df_regex(df), number=1, repeat=repeat)) * 1000
+            new = min(timeit.repeat(lambda: clean_df(df), number=1, repeat=repeat)) * 1000
+            print('%-8d %-8s %12.3f %12.3f %7.1fx' % (n, 'float' if numeric else 'str', old, new, old / new))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of analyzer.clean_df')
+    parser.add_argument('--repeat', type=int, default=50)
+    bench(parser.parse_args().repeat)
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+'''
+  Benchmark of the ingestion pipeline of the analyzer, on synthetic snapshots
+  (see generate_snapshots.py) or on a copy of the real data directory.
+
+  The stages are first timed one by one on the first market day: discovery
+  of the files, bz2 decompression, clean_df, merge with the company ids,
+  daystocks aggregation and binary COPY encoding. Then feed_database runs
+  on all the days, in this process, and the rows of stocks written per second
+  are reported, with the stage times of the run (see analyzer/metrics.py).
+  It writes to the database given by --db, which must be a new one, or else
+  to an in-memory sink which encodes the rows as for the COPY and drops them,
+  to measure the analyzer without the server.
+
+  python3 benchmarks/bench_ingestion.py [--days 5 --symbols 1000 --snapshots 50]
+      [--db bourse ricou localhost monmdp] [--output benchmarks/results.jsonl]
+
+  With --output every run is appended to the file as one JSON line, with the
+  commit of the tree, to follow the throughput over time.
+'''
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import pandas as pd
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, '..', 'analyzer'))
+import analyzer
+import mylogging
+from binary_copy import TABLE_TYPES, iter_binary_copy
+from discovery import FileManifest, parse_file_names
+from generate_snapshots import generate
+
+
+class MemorySink:
+    """ Stand-in of TimescaleStockMarketModel for feed_database, in memory.
+
+    The rows of the binary COPY tables are encoded as for the database, then
+    only counted. The companies and the daystocks closes are kept, for the
+    company ids and the indicators. The server-side steps (ytd_baselines,
+    tags, aggregates, compression policies) are skipped.
+    """
+
+    def __init__(self, aliases):
+        self.logger = mylogging.getLogger('memory_sink', level=logging.WARNING)
+        self.markets = {alias: mid for mid, alias in enumerate(aliases, 1)}
+        self.companies = pd.DataFrame({'id': pd.Series(dtype=int), 'symbol': pd.Series(dtype=object),
+                                       'mid': pd.Series(dtype=int)})
+        self.closes = []
+        self.files = set()
+        self.rows = {table: 0 for table in TABLE_TYPES}
+        self.bytes = 0
+
+    def get_market_ids(self):
+        return dict(self.markets)
+
+    def get_files_done(self):
+        return set(self.files)
+
+    def companies_of(self, mid):
+        return self.companies.loc[self.companies['mid'] == mid, ['id', 'symbol']].reset_index(drop=True)
+
+    def raw_query(self, query, args=None):
+        # the symbols of the known companies of a market, by feed_companies
+        return [(symbol,) for symbol in self.companies_of(args[0])['symbol']]
+
+    def fetch_df(self, query, params=None):
+        # the ids of the companies of a market, by process_companies
+        return self.companies_of(params[0])
+
+    def df_write_optimized(self, df, table, commit=False):
+        if table in TABLE_TYPES:
+            self.bytes += sum(len(chunk) for chunk in iter_binary_copy(df, TABLE_TYPES[table]))
+            self.rows[table] += len(df)
+            if table == 'daystocks':
+                # float4 in the database
+                self.closes.append(df[['date', 'cid']].assign(close=df['close'].astype('float32')))
+        elif table == 'companies':
+            ids = range(len(self.companies) + 1, len(self.companies) + len(df) + 1)
+            self.companies = pd.concat([self.companies,
+                                        pd.DataFrame({'id': ids, 'symbol': df['symbol'], 'mid': df['mid']})],
+                                       ignore_index=True)
+        elif table == 'file_done':
+            self.files.update(df['name'])
+
+    def set_files_done(self, names, commit=False):
+        self.df_write_optimized(pd.DataFrame({'name': names}), table='file_done', commit=commit)
+
+    def get_company_ids(self):
+        return self.companies['id'].tolist()
+
+    def get_indicator_input(self, since=None, previous=19, cids=None):
+        # no indicator before the run, they are computed on the whole history
+        closes = pd.concat(self.closes, ignore_index=True)
+        if cids is not None:
+            closes = closes[closes['cid'].isin(cids)].reset_index(drop=True)
+        return closes, None
+
+    def delete_indicators(self, since, commit=False):
+        pass
+
+    def update_ytd_baselines(self, since=None, commit=False):
+        pass
+
+    def set_tag(self, name, value, commit=False):
+        pass
+
+    def add_compression_policies(self):
+        pass
+
+    def is_daystocks_aggregate(self):
+        return False
+
+    def is_continuous_aggregate(self, view):
+        return False
+
+    def commit(self):
+        pass
+
+
+def measure(function, rows, repeat):
+    seconds = min(timeit.repeat(function, number=1, repeat=repeat))
+    return {'rows': rows, 'seconds': seconds, 'rows_per_second': rows / seconds}
+
+
+def scan_files(data_dir):
+    return FileManifest(None).scan([os.path.join(data_dir, year) for year in os.listdir(data_dir) if year.isdigit()])
+
+
+def bench_stages(files, repeat):
+    # every stage of the first day of the first market, from the output of the previous stage
+    alias = sorted(files['category'].dropna().unique())[0]
+    day_paths = analyzer.group_paths_by_day(files.loc[files['category'] == alias].set_index('date'))
+    day, paths = next(iter(day_paths.items()))
+
+    raw_dfs = [pd.read_pickle(path) for path in paths]
+    clean_dfs = [analyzer.clean_df(df) for df in raw_dfs]
+    symbols = raw_dfs[-1].index
+    cids = pd.DataFrame({'id': range(1, len(symbols) + 1), 'symbol': symbols})
+    stock_dfs = list(analyzer.iter_stocks(clean_dfs, paths.index, cids))
+    stocks_df = pd.concat(stock_dfs, ignore_index=True)
+    n_raw = sum(len(df) for df in raw_dfs)
+
+    stages = {
+        'discovery': measure(lambda: parse_file_names(files['path']), len(files), repeat),
+        'scan': measure(lambda: FileManifest(None).scan([os.path.dirname(paths.iloc[0])]),
+                        len(os.listdir(os.path.dirname(paths.iloc[0]))), repeat),
+        'read': measure(lambda: [pd.read_pickle(path) for path in paths], n_raw, repeat),
+        'clean': measure(lambda: [analyzer.clean_df(df) for df in raw_dfs], n_raw, repeat),
+        'merge': measure(lambda: list(analyzer.iter_stocks(clean_dfs, paths.index, cids)), len(stocks_df), repeat),
+        'aggregate': measure(lambda: analyzer.aggregate_daystock(stock_dfs, day), len(stocks_df), repeat),
+        'serialize': measure(lambda: b''.join(iter_binary_copy(stocks_df, TABLE_TYPES['stocks'])),
+                             len(stocks_df), repeat),
+    }
+    print('stages of market %s on %s, %d snapshots' % (alias, day.date(), len(paths)))
+    print('%-10s %10s %12s %14s' % ('stage', 'rows', 'time (ms)', 'rows/s'))
+    for name, stage in stages.items():
+        print('%-10s %10d %12.3f %14.0f' % (name, stage['rows'], stage['seconds'] * 1000, stage['rows_per_second']))
+    return stages
+
+
+def bench_end_to_end(data_dir, files, db_args=None, batch_size=5, cache_root=None):
+    # feed_database reads the data directory of the working directory
+    with tempfile.TemporaryDirectory() as workdir:
+        os.symlink(os.path.abspath(data_dir), os.path.join(workdir, 'data'))
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            if db_args is None:
+                db = analyzer.db = MemorySink(sorted(files['category'].dropna().unique()))
+            else:
+                analyzer.DB_ARGS = tuple(db_args)
+                db = analyzer.connect_database()
+                if db.get_files_done():
+                    sys.exit('the database already holds data, the benchmark needs a new one')
+            analyzer.open_cache(cache_root)
+            # what the stage benchmarks recorded is not part of the run
+            analyzer.metrics.take()
+            start = time.perf_counter()
+            run_report = analyzer.feed_database(workers=1, batch_size=batch_size, incremental=False)
+            seconds = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+
+    if db_args is None:
+        rows = {table: db.rows[table] for table in ['stocks', 'daystocks']}
+    else:
+        rows = {table: db.raw_query('SELECT count(*) FROM %s;' % table)[0][0] for table in ['stocks', 'daystocks']}
+    n_files = len(db.get_files_done())
+    size = sum(os.path.getsize(path) for path in files['path'])
+    result = {'sink': 'memory' if db_args is None else 'database', 'files': n_files, 'bytes': size,
+              **rows, 'seconds': seconds, 'rows_per_second': rows['stocks'] / seconds,
+              'files_per_second': n_files / seconds, 'mb_per_second': size / seconds / 1e6,
+              'totals': run_report.to_dict()['totals']}
+    print('end to end (%s): %d files, %d stocks and %d daystocks rows in %.2f s, '
+          '%.0f rows/s, %.1f files/s, %.2f MB/s of bz2'
+          % (result['sink'], n_files, rows['stocks'], rows['daystocks'], seconds, result['rows_per_second'],
+             result['files_per_second'], result['mb_per_second']))
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the ingestion pipeline of the analyzer')
+    parser.add_argument('--data', help='data directory to ingest (default: synthetic snapshots)')
+    parser.add_argument('--days', type=int, default=5, help='synthetic market days (default: 5)')
+    parser.add_argument('--symbols', type=int, default=1000, help='synthetic companies by market (default: 1000)')
+    parser.add_argument('--snapshots', type=int, default=50, help='synthetic snapshots a day (default: 50)')
+    parser.add_argument('--markets', nargs='+', default=['compA', 'compB'], metavar='ALIAS',
+                        help='synthetic markets (default: compA compB)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of every stage, the best is kept (default: 5)')
+    parser.add_argument('--db', nargs=4, metavar=('DATABASE', 'USER', 'HOST', 'PASSWORD'),
+                        help='new database to write to (default: in-memory sink)')
+    parser.add_argument('-b', '--batch-size', type=int, default=5,
+                        help='market days written per transaction (default: 5)')
+    parser.add_argument('--cache', action='store_true', help='go through the snapshot cache')
+    parser.add_argument('--output', help='JSON lines file the results are appended to')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data
+        if data_dir is None:
+            data_dir = os.path.join(tmp, 'data')
+            generate(data_dir, args.days, args.symbols, args.snapshots, args.markets)
+        files = scan_files(data_dir)
+        stages = bench_stages(files, args.repeat)
+        end_to_end = bench_end_to_end(data_dir, files, args.db, args.batch_size,
+                                      os.path.join(tmp, 'cache') if args.cache else None)
+
+    if args.output:
+        params = {name: getattr(args, name) for name in ['data', 'batch_size', 'cache']}
+        if args.data is None:
+            params.update({name: getattr(args, name) for name in ['days', 'symbols', 'snapshots', 'markets']})
+        with open(args.output, 'a') as f:
+            f.write(json.dumps({'date': pd.Timestamp.now(tz='UTC').isoformat(), 'commit': git_commit(),
+                                'params': params, 'stages': stages, 'end_to_end': end_to_end}) + '\n')
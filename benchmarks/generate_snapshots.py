@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+'''
+  Synthetic Boursorama snapshots, for the benchmarks of the analyzer.
+
+  The files have the layout of the real dump, one directory per year and one
+  bz2 pickle per market and snapshot, "<market> <YYYY-MM-DD HH:MM:SS.ffffff>.bz2",
+  as read by analyzer.create_path_df. Every pickle is indexed by symbol with the
+  symbol, name, last and volume columns: the prices are strings with (c)/(s)
+  suffixes and space thousands separators, the volumes are the cumulated volume
+  of the day, with missing prices and untraded companies, as cleaned by clean_df.
+
+  python3 benchmarks/generate_snapshots.py data --days 20 --symbols 1000 --snapshots 50
+'''
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+FIRST_SNAPSHOT = pd.Timedelta(hours=9)
+INTERVAL = pd.Timedelta(minutes=10)  # between two snapshots of a day
+
+
+def format_prices(prices, rng):
+    suffix = rng.choice(['', '(c)', '(s)'], len(prices), p=[0.6, 0.3, 0.1])
+    last = np.array(['{:,.2f}'.format(p).replace(',', ' ') + s for p, s in zip(prices, suffix)], dtype=object)
+    last[rng.random(len(prices)) < 0.01] = None
+    return last
+
+
+def iter_snapshots(alias, days, symbols, snapshots, start='2020-01-02', numeric=False, seed=0):
+    '''Yield the time and the dataframe of every snapshot of a market, day after day
+
+    :param days: number of market days (business days from start)
+    :param symbols: number of companies
+    :param snapshots: number of snapshots a day, INTERVAL apart
+    :param numeric: float prices instead of Boursorama strings
+    '''
+    rng = np.random.default_rng([seed, sum(map(ord, alias))])
+    codes = ['1r%s%05d' % (alias.upper(), i) for i in range(symbols)]
+    names = ['%s company %d' % (alias, i) for i in range(symbols)]
+    prices = rng.lognormal(3, 1.5, symbols)
+    for day in pd.bdate_range(start, periods=days):
+        # a fifth of the companies are not traded of the day
+        traded = rng.random(symbols) >= 0.2
+        volume = np.zeros(symbols)
+        for k in range(snapshots):
+            prices *= np.exp(rng.normal(0, 0.002, symbols))
+            volume += rng.integers(0, 2000, symbols) * traded
+            last = prices.round(2) if numeric else format_prices(prices, rng)
+            df = pd.DataFrame({'symbol': codes, 'name': names, 'last': last, 'volume': volume.copy()},
+                              index=codes)
+            # Boursorama stamps the files with microseconds
+            jitter = pd.Timedelta(microseconds=int(rng.integers(1000000)))
+            yield day + FIRST_SNAPSHOT + k * INTERVAL + jitter, df
+
+
+def generate(root, days=20, symbols=1000, snapshots=50, markets=('compA',), start='2020-01-02',
+             numeric=False, seed=0):
+    '''Write the snapshots of the markets below root, return the paths of the files'''
+    paths = []
+    for alias in markets:
+        for time, df in iter_snapshots(alias, days, symbols, snapshots, start, numeric, seed):
+            directory = os.path.join(root, str(time.year))
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, '%s %s.bz2' % (alias, time.strftime('%Y-%m-%d %H:%M:%S.%f')))
+            df.to_pickle(path)
+            paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic Boursorama snapshots')
+    parser.add_argument('root', help='directory of the year directories, the data directory of the analyzer')
+    parser.add_argument('--days', type=int, default=20, help='number of market days (default: 20)')
+    parser.add_argument('--symbols', type=int, default=1000, help='companies of every market (default: 1000)')
+    parser.add_argument('--snapshots', type=int, default=50, help='snapshots a day (default: 50)')
+    parser.add_argument('--markets', nargs='+', default=['compA'], metavar='ALIAS',
+                        help='market aliases, the prefix of the files (default: compA)')
+    parser.add_argument('--start', default='2020-01-02', help='first day (default: 2020-01-02)')
+    parser.add_argument('--numeric', action='store_true', help='float prices instead of strings')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    paths = generate(args.root, args.days, args.symbols, args.snapshots, args.markets, args.start,
+                     args.numeric, args.seed)
+    print('%d files written below %s' % (len(paths), args.root))
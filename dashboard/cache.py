@@ -0,0 +1,302 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+
+class IngestionStamp:
+    """Time of the last analyzer run, from the tags table.
+
+    The analyzer writes it at the end of every run which ingested data. It is
+    read again at most every `interval` seconds, the caches of the dashboard
+    compare it to the one they were filled with.
+
+    Args:
+        db (Database): the data access layer
+        interval (float): seconds between two reads of the tag
+    """
+
+    def __init__(self, db, interval=30):
+        self.db = db
+        self.interval = interval
+        self._value = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """function to get the time of the last ingestion
+
+        Returns:
+            str: the time of the last ingestion, None if not known
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._checked is None or now - self._checked >= self.interval:
+                df = self.db.query("last_ingestion")
+                self._value = df["value"].values[0] if len(df) else None
+                self._checked = now
+            return self._value
+
+
+class CompanyCache:
+    """The companies table, held in memory.
+
+    Loaded at once on first use, then every name and symbol lookup of the
+    callbacks is a dictionary access. It is loaded again after an analyzer
+    run (new stamp) or an explicit invalidate().
+
+    Args:
+        db (Database): the data access layer
+        stamp (IngestionStamp): time of the last ingestion, None to only invalidate explicitly
+    """
+
+    def __init__(self, db, stamp=None):
+        self.db = db
+        self.stamp = stamp
+        self._lock = threading.Lock()
+        self._loaded_stamp = None
+        self._companies = None
+        self._by_mid = None
+
+    def invalidate(self):
+        """function to forget the companies, loaded again on next use"""
+        with self._lock:
+            self._companies = None
+
+    def _get(self):
+        stamp = self.stamp.get() if self.stamp is not None else None
+        with self._lock:
+            if self._companies is None or stamp != self._loaded_stamp:
+                companies = self.db.query("all_companies")
+                self._by_mid = {mid: df.reset_index(drop=True) for mid, df in companies.groupby("mid")}
+                self._companies = companies.set_index("id", drop=False)
+                self._loaded_stamp = stamp
+            return self._companies, self._by_mid
+
+    def by_mid(self, mid):
+        """function to get the companies of a market
+
+        Args:
+            mid (int): market id
+
+        Returns:
+            pd.DataFrame: companies
+        """
+        companies, by_mid = self._get()
+        if mid not in by_mid:
+            return companies.iloc[:0].reset_index(drop=True)
+        return by_mid[mid].copy()
+
+    def get(self, cid):
+        """function to get a company
+
+        Args:
+            cid (int): company id
+
+        Returns:
+            pd.Series: the columns of the company
+        """
+        companies, _ = self._get()
+        return companies.loc[cid]
+
+    def names(self):
+        """function to get the names of all the companies
+
+        Returns:
+            pd.Series: company names indexed by company id
+        """
+        companies, _ = self._get()
+        return companies["name"]
+
+
+class RangeCache:
+    """Results of the daystocks range reads, held in memory.
+
+    An entry is the daystocks of a set of companies between two dates (None
+    for no bound). A read is served by an entry of the same companies and
+    dates, or by an entry of more companies and/or a wider range, filtered.
+    The candlesticks of a bucket width (a week, a month) are entries of their
+    own: the first and last buckets of a narrower range are partial, so they
+    are only served by an entry of more companies over the same range. The
+    least recently used entries are evicted when the cache holds more than
+    `max_rows` rows, and all of them after an analyzer run.
+
+    Args:
+        db (Database): the data access layer, for the timezone of the dates
+        stamp (IngestionStamp): time of the last ingestion, None for no expiry
+        max_rows (int): maximum number of rows held
+    """
+
+    def __init__(self, db, stamp=None, max_rows=1000000):
+        self.db = db
+        self.stamp = stamp
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (cids, start, end, bucket) -> dataframe, least recently used first
+        self._rows = 0
+        self._loaded_stamp = None
+        self._timezone = None
+        self._stats = {"hits": 0, "subrange_hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def _bound(self, date):
+        # the dates of the date pickers are naive, the database reads them in its timezone
+        if date is None:
+            return None
+        date = pd.Timestamp(date)
+        if date.tzinfo is None:
+            if self._timezone is None:
+                self._timezone = self.db.query("timezone")["value"].values[0]
+            date = date.tz_localize(self._timezone)
+        return date
+
+    @staticmethod
+    def _contains(entry, key):
+        cids, start, end, bucket = entry
+        if bucket != key[3]:
+            return False
+        if bucket is not None:
+            return key[0] <= cids and (start, end) == key[1:3]
+        return (key[0] <= cids
+                and (start is None or (key[1] is not None and start <= key[1]))
+                and (end is None or (key[2] is not None and key[2] <= end)))
+
+    def get(self, cids, start_date, end_date, load, bucket=None):
+        """function to get the daystocks of companies between two dates
+
+        Args:
+            cids (list[int]): company ids
+            start_date (timestamp): the start date, None for no bound
+            end_date (timestamp): the end date, None for no bound
+            load (function): reads them in the database, on a miss
+            bucket (str): width of the candlesticks, None for the days
+
+        Returns:
+            pd.DataFrame: daystocks
+        """
+        if start_date is None or end_date is None:
+            start_date = end_date = None
+        key = (frozenset(cids), self._bound(start_date), self._bound(end_date), bucket)
+        stamp = self.stamp.get() if self.stamp is not None else None
+        with self._lock:
+            if stamp != self._loaded_stamp:
+                if self._entries:
+                    self._stats["expirations"] += 1
+                self._entries.clear()
+                self._rows = 0
+                self._loaded_stamp = stamp
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return self._entries[key].copy()
+            for entry in reversed(self._entries):
+                if self._contains(entry, key):
+                    self._entries.move_to_end(entry)
+                    self._stats["subrange_hits"] += 1
+                    df = self._entries[entry]
+                    mask = df["cid"].isin(key[0])
+                    if key[1] is not None and bucket is None:
+                        mask &= (df["date"] >= key[1]) & (df["date"] <= key[2])
+                    return df[mask].reset_index(drop=True)
+            self._stats["misses"] += 1
+
+        df = load()
+        with self._lock:
+            if stamp == self._loaded_stamp and key not in self._entries and len(df) <= self.max_rows:
+                self._entries[key] = df
+                self._rows += len(df)
+                while self._rows > self.max_rows:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._rows -= len(evicted)
+                    self._stats["evictions"] += 1
+        return df.copy()
+
+    def stats(self):
+        """function to get the counters of the cache
+
+        Returns:
+            dict: hits, sub-range hits, misses, evictions, expirations, entries and rows held
+        """
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), rows=self._rows)
+
+
+class LayoutCache:
+    """Layouts of the pages and options of their dropdowns, held in memory.
+
+    A value is built once by its function, on first use or when the cache is
+    warmed, then served as is, so switching pages does not touch the database.
+    The values are built again after an analyzer run (new stamp) or an explicit
+    invalidate().
+
+    Args:
+        stamp (IngestionStamp): time of the last ingestion, None to only invalidate explicitly
+    """
+
+    def __init__(self, stamp=None):
+        self.stamp = stamp
+        self._lock = threading.Lock()
+        self._values = {}
+        self._loaded_stamp = None
+        self._stats = {"hits": 0, "builds": 0}
+
+    def invalidate(self):
+        """function to forget the values, built again on next use"""
+        with self._lock:
+            self._values.clear()
+
+    def get(self, key, build):
+        """function to get a value
+
+        Args:
+            key (hashable): name of the value
+            build (function): builds it, on a miss
+
+        Returns:
+            object: the value, shared by all the callers, not to be modified
+        """
+        stamp = self.stamp.get() if self.stamp is not None else None
+        with self._lock:
+            if stamp != self._loaded_stamp:
+                self._values.clear()
+                self._loaded_stamp = stamp
+            if key in self._values:
+                self._stats["hits"] += 1
+                return self._values[key]
+        value = build()
+        with self._lock:
+            self._stats["builds"] += 1
+            if stamp == self._loaded_stamp:
+                self._values[key] = value
+        return value
+
+    def start(self, warm, interval=None):
+        """function to warm the cache now and after every analyzer run, in a background thread
+
+        Args:
+            warm (function): gets all the values to build
+            interval (float): seconds between two warm-ups, the interval of the stamp by default
+        """
+        if interval is None:
+            interval = self.stamp.interval if self.stamp is not None else 60
+
+        def run():
+            while True:
+                try:
+                    warm()
+                except Exception:
+                    # database not up yet, the values are built on first use meanwhile
+                    logging.getLogger(__name__).exception("layout cache warm-up failed")
+                time.sleep(interval)
+
+        threading.Thread(target=run, name="layout-cache", daemon=True).start()
+
+    def stats(self):
+        """function to get the counters of the cache
+
+        Returns:
+            dict: hits, builds and values held
+        """
+        with self._lock:
+            return dict(self._stats, values=len(self._values))
@@ -0,0 +1,313 @@
+import threading
+import time
+
+import pandas as pd
+import psycopg2
+import psycopg2.pool
+
+# type oids of the timestamps, converted to datetime64 columns
+TIMESTAMP_OIDS = (1114, 1184)
+# limits of the queries typed in the SQL console
+CONSOLE_MAX_ROWS = 1000
+CONSOLE_TIMEOUT = 10  # seconds
+# the statements a server-side cursor can run (DECLARE CURSOR), the others are run by a client-side cursor
+CURSOR_STATEMENTS = ("select", "values", "with", "table")
+
+
+def single_statement(sql):
+    """function to check that a query typed by a user is a single statement
+
+    Semicolons in strings, quoted names and comments are ignored, a final one is removed.
+
+    Args:
+        sql (str): the query
+
+    Returns:
+        str: the statement, without its final semicolon
+
+    Raises:
+        ValueError: if it is empty or holds several statements
+    """
+    end = None
+    i, n = 0, len(sql)
+    while i < n:
+        c = sql[i]
+        if c == "'" and sql[i - 1:i] in ("e", "E") and not (sql[i - 2:i - 1].isalnum() or sql[i - 2:i - 1] in ("_", "$")):
+            # escape string, where \' does not end it
+            i += 1
+            while i < n and sql[i] != "'":
+                i += 2 if sql[i] == "\\" else 1
+            i += 1
+            continue
+        if c in "'\"":
+            i = sql.find(c, i + 1)
+            # '' and "" inside a string are found as the end and the start of the next one
+            i = n if i < 0 else i + 1
+            continue
+        if sql.startswith("--", i):
+            i = sql.find("\n", i)
+            i = n if i < 0 else i
+            continue
+        if sql.startswith("/*", i):
+            i = sql.find("*/", i + 2)
+            i = n if i < 0 else i + 2
+            continue
+        if c == "$":
+            # dollar quoted string, $$...$$ or $tag$...$tag$
+            close = sql.find("$", i + 1)
+            tag = sql[i:close + 1] if close > 0 else ""
+            if tag and (tag == "$$" or tag[1:-1].isidentifier()):
+                close = sql.find(tag, close + 1)
+                i = n if close < 0 else close + len(tag)
+                continue
+        if c == ";":
+            if end is None:
+                end = i
+        elif end is not None and not c.isspace():
+            raise ValueError("one statement at a time")
+        i += 1
+    statement = sql[:end].strip() if end is not None else sql.strip()
+    if not statement:
+        raise ValueError("empty query")
+    return statement
+
+
+def first_keyword(sql):
+    """function to get the keyword a statement starts with, after its comments and parentheses
+
+    Args:
+        sql (str): the statement
+
+    Returns:
+        str: the keyword, in lower case
+    """
+    i, n = 0, len(sql)
+    while i < n:
+        if sql[i].isspace() or sql[i] == "(":
+            i += 1
+        elif sql.startswith("--", i):
+            i = sql.find("\n", i)
+            i = n if i < 0 else i
+        elif sql.startswith("/*", i):
+            i = sql.find("*/", i + 2)
+            i = n if i < 0 else i + 2
+        else:
+            break
+    end = i
+    while end < n and (sql[end].isalnum() or sql[end] == "_"):
+        end += 1
+    return sql[i:end].lower()
+
+
+def to_frame(rows, description):
+    """function to convert the rows of a cursor to a dataframe
+
+    Args:
+        rows (list[tuple]): the rows
+        description (tuple): the columns of the cursor
+
+    Returns:
+        pd.DataFrame: the rows, the timestamps as datetime64 (in UTC with a time zone)
+    """
+    df = pd.DataFrame.from_records(rows, columns=[column.name for column in description], coerce_float=True)
+    for i, column in enumerate(description):
+        if column.type_code in TIMESTAMP_OIDS:
+            df.isetitem(i, pd.to_datetime(df.iloc[:, i], utc=column.type_code == 1184))
+    return df
+
+
+class Database:
+    """Access to the bourse database for the dashboard.
+
+    Connections come from a pool of fixed size, shared by the threads of the
+    process. Every query is a server-side prepared statement with typed
+    parameters, prepared once per connection on first use, so a callback
+    neither opens a connection nor plans its query. The pool records how long
+    callbacks wait for a connection and how long the queries take, and calls
+    `observer` (name, seconds, rows), if set, after every query.
+
+    Args:
+        dsn (str): libpq connection string
+        statements (dict): name -> (parameter types, SQL with $1, $2... parameters)
+        pool_size (int): maximum number of connections
+    """
+
+    def __init__(self, dsn, statements, pool_size=4):
+        self.dsn = dsn
+        self.statements = statements
+        self.pool_size = pool_size
+        self._pool = None
+        self._lock = threading.Lock()
+        # a callback waits for a free connection instead of failing when all are in use
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self.observer = None
+        self._prepared = {}  # connection -> names of the statements prepared on it
+        self._metrics = {
+            "connections_opened": 0,
+            "connections_discarded": 0,
+            "checkouts": 0,
+            "in_use": 0,
+            "waiting": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "prepares": 0,
+            "queries": {},  # name -> [count, total seconds, max seconds]
+        }
+
+    def _get_pool(self):
+        # opened on first use, the dashboard starts even if the database is not up yet.
+        # minconn = maxconn, psycopg2 closes the connections given back above minconn
+        with self._lock:
+            if self._pool is None:
+                self._pool = psycopg2.pool.ThreadedConnectionPool(self.pool_size, self.pool_size, self.dsn)
+            return self._pool
+
+    def _checkout(self):
+        with self._lock:
+            self._metrics["waiting"] += 1
+        start = time.perf_counter()
+        self._slots.acquire()
+        wait = time.perf_counter() - start
+        try:
+            conn = self._get_pool().getconn()
+        except Exception:
+            self._slots.release()
+            with self._lock:
+                self._metrics["waiting"] -= 1
+            raise
+        conn.autocommit = True
+        with self._lock:
+            self._metrics["waiting"] -= 1
+            self._metrics["checkouts"] += 1
+            self._metrics["in_use"] += 1
+            self._metrics["wait_seconds"] += wait
+            self._metrics["max_wait_seconds"] = max(self._metrics["max_wait_seconds"], wait)
+            if conn not in self._prepared:
+                self._prepared[conn] = set()
+                self._metrics["connections_opened"] += 1
+        return conn
+
+    def _checkin(self, conn, broken=False):
+        with self._lock:
+            self._metrics["in_use"] -= 1
+            if broken:
+                self._prepared.pop(conn, None)
+                self._metrics["connections_discarded"] += 1
+        self._get_pool().putconn(conn, close=broken)
+        self._slots.release()
+
+    def _prepare(self, conn, cursor, name):
+        if name in self._prepared[conn]:
+            return
+        types, sql = self.statements[name]
+        types = f"({', '.join(types)})" if types else ""
+        cursor.execute(f"PREPARE {name} {types} AS {sql}")
+        self._prepared[conn].add(name)
+        with self._lock:
+            self._metrics["prepares"] += 1
+
+    def query(self, name, *args):
+        """function to run a prepared statement
+
+        Args:
+            name (str): name of the statement
+            *args: its parameters, in order
+
+        Returns:
+            pd.DataFrame: the rows of the result
+        """
+        conn = self._checkout()
+        broken = False
+        try:
+            start = time.perf_counter()
+            with conn.cursor() as cursor:
+                self._prepare(conn, cursor, name)
+                placeholders = ", ".join(["%s"] * len(args))
+                cursor.execute(f"EXECUTE {name} ({placeholders})" if args else f"EXECUTE {name}", args)
+                rows = cursor.fetchall()
+                description = cursor.description
+            self._record(name, time.perf_counter() - start, len(rows))
+        except psycopg2.OperationalError:
+            # lost connection, replaced by a new one at the next checkout
+            broken = True
+            raise
+        finally:
+            self._checkin(conn, broken)
+
+        return to_frame(rows, description)
+
+    def console(self, sql, explain=False, max_rows=CONSOLE_MAX_ROWS, timeout=CONSOLE_TIMEOUT):
+        """function to run a query typed by a user in the SQL console
+
+        The query runs in a read-only transaction, rolled back at the end,
+        stopped by the server after `timeout` seconds. The rows of a query are
+        read with a server-side cursor, the other statements (SHOW, EXPLAIN...)
+        with a client-side one. Only the first `max_rows` are sent to the dashboard.
+
+        Args:
+            sql (str): a single statement
+            explain (bool): run it with EXPLAIN ANALYZE and return the plan
+            max_rows (int): maximum number of rows returned
+            timeout (float): maximum duration of the query, in seconds
+
+        Returns:
+            tuple: the rows (pd.DataFrame, the lines of the plan with explain)
+                and whether there were more than max_rows
+        """
+        sql = single_statement(sql)
+        server_side = not explain and first_keyword(sql) in CURSOR_STATEMENTS
+        conn = self._checkout()
+        try:
+            start = time.perf_counter()
+            conn.autocommit = False
+            conn.readonly = True
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SET LOCAL statement_timeout = %s", (int(timeout * 1000),))
+                    if not server_side:
+                        cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql if explain else sql)
+                        # no rows for a utility statement
+                        rows = cursor.fetchmany(max_rows + 1) if cursor.description else []
+                        description = cursor.description
+                if server_side:
+                    with conn.cursor(name="console") as cursor:
+                        cursor.itersize = max_rows + 1
+                        cursor.execute(sql)
+                        rows = cursor.fetchmany(max_rows + 1)
+                        description = cursor.description
+            finally:
+                if not conn.closed:
+                    conn.rollback()
+                    conn.readonly = None
+                    conn.autocommit = True
+            self._record("console", time.perf_counter() - start, len(rows))
+        finally:
+            # a timeout leaves the connection good, a lost server closes it
+            self._checkin(conn, bool(conn.closed))
+
+        if description is None:
+            return pd.DataFrame(), False
+        return to_frame(rows[:max_rows], description), len(rows) > max_rows
+
+    def _record(self, name, seconds, rows):
+        with self._lock:
+            stats = self._metrics["queries"].setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+        if self.observer is not None:
+            self.observer(name, seconds, rows)
+
+    def metrics(self):
+        """function to get the metrics of the pool and of the queries
+
+        Returns:
+            dict: pool counters, and count, total and max seconds of every statement
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["queries"] = {name: {"count": count, "total_seconds": total, "max_seconds": worst}
+                                  for name, (count, total, worst) in self._metrics["queries"].items()}
+        metrics["pool_size"] = self.pool_size
+        metrics["connections"] = len(self._prepared)
+        return metrics
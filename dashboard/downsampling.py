@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+PLOT_WIDTH = 1200  # width of the graphs in pixels
+MAX_POINTS = PLOT_WIDTH // 2  # points of a trace, at least 2 pixels each
+
+# bucket widths of the candlesticks, by increasing width: name -> days
+BUCKETS = [(None, 1), ("1 week", 7), ("1 month", 31)]
+
+
+def choose_bucket(start_date, end_date, max_points=MAX_POINTS):
+    """function to choose the width of the candlesticks of a date range
+
+    Args:
+        start_date (timestamp): the start date
+        end_date (timestamp): the end date
+        max_points (int): maximum number of candlesticks
+
+    Returns:
+        str: the interval of the buckets, None for one candlestick per day
+    """
+    days = (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days + 1
+    for bucket, width in BUCKETS:
+        if days / width <= max_points:
+            return bucket
+    return BUCKETS[-1][0]
+
+
+def lttb_indices(x, y, max_points=MAX_POINTS):
+    """function to downsample a line with the Largest Triangle Three Buckets algorithm
+
+    The first and last points are kept. The others are cut in max_points - 2
+    buckets, and in each bucket the point which makes the largest triangle with
+    the point kept in the previous bucket and the mean of the next bucket is kept.
+
+    Args:
+        x (array): x of the points, in increasing order (numbers or dates)
+        y (array): y of the points
+        max_points (int): number of points kept
+
+    Returns:
+        np.ndarray: the indices of the points kept
+    """
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+    if pd.api.types.is_datetime64_any_dtype(x):
+        x = pd.DatetimeIndex(x).asi8
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    indices = np.empty(max_points, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(max_points - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        mean_x, mean_y = x[stop:next_stop].mean(), y[stop:next_stop].mean()
+        area = np.abs((x[a] - mean_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (mean_y - y[a]))
+        a = start + int(area.argmax())
+        indices[i + 1] = a
+    return indices
@@ -0,0 +1,184 @@
+import functools
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+import plotly.io.json
+
+# a query slower than this is kept in the slow queries of the profiler
+SLOW_QUERY_SECONDS = 0.5
+
+
+class Profiler:
+    """Latency of the callbacks and of the query helpers of the dashboard.
+
+    Every call of a wrapped function is a sample: its wall time, the time and
+    rows of the queries run by its thread during the call, the rows it
+    returns and, for the callbacks, the size and encoding time of the JSON
+    response. The percentiles are computed over the last `window` samples of
+    every function. The last `slow_count` queries slower than `slow_seconds`
+    are kept with the callback which ran them.
+
+    Args:
+        window (int): samples kept by function
+        slow_seconds (float): duration above which a query is slow
+        slow_count (int): slow queries kept
+    """
+
+    def __init__(self, window=1000, slow_seconds=SLOW_QUERY_SECONDS, slow_count=50):
+        self.window = window
+        self.slow_seconds = slow_seconds
+        self._samples = {}  # name -> deque of (wall, sql seconds, queries, sql rows, rows, bytes, encode seconds)
+        self._calls = {}  # name -> calls since the start or the last reset
+        self._slow = deque(maxlen=slow_count)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _frames(self):
+        # the profiled calls running in this thread, outermost first: [name, sql seconds, queries, sql rows]
+        if not hasattr(self._local, "frames"):
+            self._local.frames = []
+        return self._local.frames
+
+    def wrap(self, function, name=None, payload=False):
+        """function to time every call of a function
+
+        Args:
+            function (callable): the function
+            name (str): name of its samples, the name of the function by default
+            payload (bool): measure the JSON encoding of the result, for the callbacks
+
+        Returns:
+            callable: the function, profiled
+        """
+        name = name or function.__name__
+
+        @functools.wraps(function)
+        def profiled(*args, **kwargs):
+            frames = self._frames()
+            frame = [name, 0.0, 0, 0]
+            frames.append(frame)
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                frames.pop()
+            wall = time.perf_counter() - start
+            size = encode = None
+            if payload:
+                # as dash encodes the response
+                start = time.perf_counter()
+                size = len(plotly.io.json.to_json_plotly(result))
+                encode = time.perf_counter() - start
+            rows = len(result) if isinstance(result, (pd.DataFrame, pd.Series)) else None
+            self._add(name, (wall, frame[1], frame[2], frame[3], rows, size, encode))
+            return result
+
+        return profiled
+
+    def record_query(self, name, seconds, rows):
+        """function to count a query in the calls running in this thread, the observer of Database
+
+        Args:
+            name (str): name of the statement
+            seconds (float): its duration
+            rows (int): rows returned
+        """
+        frames = self._frames()
+        for frame in frames:
+            frame[1] += seconds
+            frame[2] += 1
+            frame[3] += rows
+        if seconds >= self.slow_seconds:
+            with self._lock:
+                self._slow.append({
+                    "time": pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "statement": name,
+                    "caller": frames[0][0] if frames else None,
+                    "ms": round(seconds * 1000, 1),
+                    "rows": rows,
+                })
+
+    def _add(self, name, sample):
+        with self._lock:
+            if name not in self._samples:
+                self._samples[name] = deque(maxlen=self.window)
+                self._calls[name] = 0
+            self._samples[name].append(sample)
+            self._calls[name] += 1
+
+    def reset(self):
+        """function to forget the samples and the slow queries"""
+        with self._lock:
+            self._samples.clear()
+            self._calls.clear()
+            self._slow.clear()
+
+    def stats(self):
+        """function to get the percentiles of every profiled function
+
+        Returns:
+            pd.DataFrame: by function, slowest p95 first: calls, wall time percentiles (ms), mean SQL
+                time (ms), its share of the wall time, mean queries, SQL rows and returned rows,
+                mean response size (kB) and p95 of its encoding (ms)
+        """
+        with self._lock:
+            samples = {name: np.array(list(values), dtype=float) for name, values in self._samples.items()}
+            calls = dict(self._calls)
+        rows = []
+        for name, values in samples.items():
+            wall, sql, queries, sql_rows, result_rows, size, encode = (values * [1000, 1000, 1, 1, 1, 1e-3, 1000]).T
+            p50, p95, p99 = np.percentile(wall, [50, 95, 99])
+            rows.append({
+                "name": name,
+                "calls": calls[name],
+                "p50_ms": p50,
+                "p95_ms": p95,
+                "p99_ms": p99,
+                "max_ms": wall.max(),
+                "sql_ms": sql.mean(),
+                "sql_share": sql.sum() / wall.sum() if wall.sum() else 0.0,
+                "queries": queries.mean(),
+                "sql_rows": sql_rows.mean(),
+                "rows": np.nanmean(result_rows) if not np.isnan(result_rows).all() else None,
+                "response_kb": np.nanmean(size) if not np.isnan(size).all() else None,
+                "encode_p95_ms": np.nanpercentile(encode, 95) if not np.isnan(encode).all() else None,
+            })
+        columns = ["name", "calls", "p50_ms", "p95_ms", "p99_ms", "max_ms", "sql_ms", "sql_share", "queries",
+                   "sql_rows", "rows", "response_kb", "encode_p95_ms"]
+        return pd.DataFrame(rows, columns=columns).sort_values("p95_ms", ascending=False, ignore_index=True)
+
+    def slow_queries(self):
+        """function to get the last slow queries
+
+        Returns:
+            list[dict]: time, statement, calling function, duration (ms) and rows, the last first
+        """
+        with self._lock:
+            return list(reversed(self._slow))
+
+
+def profile_callbacks(app, profiler, exclude=()):
+    """function to profile the callbacks declared from now on with app.callback
+
+    Args:
+        app (dash.Dash): the application
+        profiler (Profiler): the profiler
+        exclude (tuple[str]): names of the functions not to profile
+    """
+    callback = app.callback
+
+    @functools.wraps(callback)
+    def profiled_callback(*args, **kwargs):
+        register = callback(*args, **kwargs)
+
+        def decorator(function):
+            if function.__name__ in exclude:
+                return register(function)
+            return register(profiler.wrap(function, payload=True))
+
+        return decorator
+
+    app.callback = profiled_callback
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from downsampling import MAX_POINTS, lttb_indices
+
+# colors of the companies, in the order they are selected
+COLORS = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf"]
+
+
+def split_companies(df, cids, columns):
+    """function to split the daystocks of several companies into one block of arrays each
+
+    The rows are sorted once by company and date, the block of a company is
+    made of views of the sorted arrays, so its cost does not depend on the
+    number of companies.
+
+    Args:
+        df (pd.DataFrame): daystocks, with date and cid columns
+        cids (list[int]): company ids, in the order of the blocks
+        columns (list[str]): columns of the blocks, besides the date
+
+    Returns:
+        dict: company id -> column -> array ordered by date (datetime64 in UTC for the date,
+            as plotly sends the dates with a time zone), for the companies of cids which have rows
+    """
+    # in nanoseconds whatever the unit of the column, naive in UTC
+    dates = pd.DatetimeIndex(df["date"])
+    if dates.tz is not None:
+        dates = dates.tz_convert("UTC").tz_localize(None)
+    dates = dates.as_unit("ns").to_numpy()
+    cid = df["cid"].to_numpy()
+    order = np.lexsort((dates, cid))
+    cid = cid[order]
+    arrays = {"date": dates[order], **{column: df[column].to_numpy()[order] for column in columns}}
+    starts = np.flatnonzero(np.r_[True, cid[1:] != cid[:-1]]) if len(cid) else np.array([], dtype=int)
+    stops = np.r_[starts[1:], len(cid)]
+    bounds = {int(cid[start]): (start, stop) for start, stop in zip(starts, stops)}
+    return {int(c): {name: array[slice(*bounds[int(c)])] for name, array in arrays.items()}
+            for c in cids if int(c) in bounds}
+
+
+def company_traces(blocks, graph_type, names, max_points=MAX_POINTS):
+    """function to build the candlestick or line trace of every company
+
+    Args:
+        blocks (dict): company id -> date, open, high, low and close arrays, from split_companies
+        graph_type (str): "candlestick" or "line"
+        names (dict): company id -> name
+        max_points (int): maximum number of points of a line
+
+    Returns:
+        list: the traces, one per company with its color
+    """
+    traces = []
+    for i, (cid, block) in enumerate(blocks.items()):
+        color = COLORS[i % len(COLORS)]
+        if graph_type == "candlestick":
+            traces.append(go.Candlestick(
+                x=block["date"],
+                open=block["open"],
+                high=block["high"],
+                low=block["low"],
+                close=block["close"],
+                name=names[cid],
+                increasing_line_color=color,
+                decreasing_line_color=lighten_color(color),
+            ))
+        else:
+            # bounded number of points by company
+            keep = lttb_indices(block["date"], block["close"], max_points)
+            traces.append(go.Scatter(
+                x=block["date"][keep],
+                y=block["close"][keep],
+                mode="lines",
+                name=names[cid],
+                line=dict(color=color),
+            ))
+    return traces
+
+
+def company_rows(blocks, names, columns):
+    """function to put the blocks of several companies back in one table, ordered by date
+
+    Args:
+        blocks (dict): company id -> column -> array, from split_companies
+        names (dict): company id -> name
+        columns (list[str]): columns of the table, besides the date and the name
+
+    Returns:
+        pd.DataFrame: date (in UTC), name and columns
+    """
+    lengths = [len(block["date"]) for block in blocks.values()]
+    dates = np.concatenate([block["date"] for block in blocks.values()])
+    order = np.argsort(dates, kind="stable")
+    df = pd.DataFrame({
+        "date": dates[order],
+        "name": np.repeat([names[cid] for cid in blocks], lengths)[order],
+        **{column: np.concatenate([block[column] for block in blocks.values()])[order] for column in columns},
+    })
+    return df
+
+
+def lighten_color(color, factor=0.5):
+    """Lighten the given color."""
+    color = color.lstrip("#")
+    rgb = tuple(int(color[i : i + 2], 16) for i in (0, 2, 4))
+    lightened_rgb = tuple(int((255 - c) * factor + c) for c in rgb)
+    lightened_color = "#{:02x}{:02x}{:02x}".format(*lightened_rgb)
+    return lightened_color
@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'analyzer'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+import analyzer
+from bench_ingestion import MemorySink
+from generate_snapshots import iter_snapshots
+
+
+@pytest.fixture
+def aliases_of_one_market(tmp_path, monkeypatch):
+    # euronx and peapme are both market 1, peapme lists a part of the companies of euronx
+    # a minute after it
+    for time, df in iter_snapshots('compA', days=2, symbols=20, snapshots=3):
+        for alias, delay, snapshot in [('euronx', 0, df), ('peapme', 1, df.iloc[:10])]:
+            time = time + pd.Timedelta(minutes=delay)
+            directory = tmp_path / 'data' / str(time.year)
+            directory.mkdir(parents=True, exist_ok=True)
+            snapshot.to_pickle(directory / ('%s %s.bz2' % (alias, time.strftime('%Y-%m-%d %H:%M:%S.%f'))))
+    monkeypatch.chdir(tmp_path)
+    sink = MemorySink([])
+    sink.markets = {'euronx': 1, 'peapme': 1}
+    monkeypatch.setattr(analyzer, 'db', sink)
+    analyzer.open_cache(str(tmp_path / 'cache'))
+    yield sink
+    analyzer.open_cache(None)
+
+
+def test_aliases_of_one_market_share_a_pipeline(aliases_of_one_market, monkeypatch):
+    sink = aliases_of_one_market
+    pipelines = []
+    feed_market = analyzer.feed_market
+
+    def recorded_feed_market(alias, mid, *args):
+        pipelines.append((alias, mid))
+        return feed_market(alias, mid, *args)
+
+    monkeypatch.setattr(analyzer, 'feed_market', recorded_feed_market)
+    analyzer.feed_database(incremental=False)
+
+    assert pipelines == [('euronx/peapme', 1)]
+    # every company once, one daystock per company and day
+    assert len(sink.companies) == 20
+    assert not sink.companies['symbol'].duplicated().any()
+    closes = pd.concat(sink.closes)
+    assert len(closes) == len(closes.drop_duplicates(['date', 'cid']))
+    assert len(sink.files) == 2 * 2 * 3
+
+    # one cache directory per day, with the files of both aliases
+    days = sorted(d for d in os.listdir(os.path.join('cache', '1')) if d.isdigit())
+    assert len(days) == 2
+    for day in days:
+        paths = analyzer.cache.read_day(1, pd.Timestamp(day))['paths']
+        assert sorted(os.path.basename(path).split()[0] for path in paths) == ['euronx'] * 3 + ['peapme'] * 3
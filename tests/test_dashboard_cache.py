@@ -0,0 +1,96 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dashboard'))
+import utils
+from cache import IngestionStamp, RangeCache
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    # the statements run, answered without a database
+    run = []
+
+    def query(name, *args):
+        run.append(name)
+        if name == "last_ingestion":
+            return pd.DataFrame({"value": ["2024-01-01T00:00:00+00:00"]})
+        if name == "timezone":
+            return pd.DataFrame({"value": ["UTC"]})
+        cids = args[0]
+        dates = pd.date_range("2018-12-31", "2023-12-25", freq="W-MON", tz="UTC")
+        return pd.DataFrame({"date": dates.repeat(len(cids)), "cid": cids * len(dates), "open": 1.0,
+                             "close": 1.0, "high": 1.0, "low": 1.0, "volume": 10})
+
+    monkeypatch.setattr(utils.db, "query", query)
+    monkeypatch.setattr(utils, "ingestion_stamp", IngestionStamp(utils.db))
+    monkeypatch.setattr(utils, "buckets_cache", RangeCache(utils.db, utils.ingestion_stamp))
+    return run
+
+
+def test_long_range_candlesticks_are_cached(queries):
+    first = utils.get_candlesticks([1, 2], "2019-01-01", "2023-12-31")
+    again = utils.get_candlesticks([2, 1], "2019-01-01", "2023-12-31")
+    assert queries.count("daystocks_buckets") == 1
+    pd.testing.assert_frame_equal(first, again)
+
+    # a company of the range is served by the entry, with its first partial bucket
+    one = utils.get_candlesticks([2], "2019-01-01", "2023-12-31")
+    assert queries.count("daystocks_buckets") == 1
+    assert one["cid"].eq(2).all() and one["date"].min() < pd.Timestamp("2019-01-01", tz="UTC")
+
+    # a narrower range has other first and last buckets, it is read again
+    utils.get_candlesticks([1, 2], "2019-06-01", "2023-12-31")
+    assert queries.count("daystocks_buckets") == 2
+
+
+def test_candlesticks_expire_after_an_ingestion(queries, monkeypatch):
+    utils.get_candlesticks([1], "2019-01-01", "2023-12-31")
+    monkeypatch.setattr(utils.ingestion_stamp, "get", lambda: "2024-01-02T00:00:00+00:00")
+    utils.get_candlesticks([1], "2019-01-01", "2023-12-31")
+    assert queries.count("daystocks_buckets") == 2
+
+
+@pytest.fixture
+def paris_daystocks():
+    # a database to run the statements on, with TimescaleDB: BOURSE_TEST_DSN="dbname=... user=..."
+    dsn = os.environ.get("BOURSE_TEST_DSN")
+    if not dsn:
+        pytest.skip("BOURSE_TEST_DSN is not set")
+    import psycopg2
+    from data_access import Database
+
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("DROP SCHEMA IF EXISTS test_buckets CASCADE; CREATE SCHEMA test_buckets;")
+        cursor.execute("""CREATE TABLE test_buckets.daystocks (date TIMESTAMPTZ, cid SMALLINT, open FLOAT4,
+                          close FLOAT4, high FLOAT4, low FLOAT4, volume BIGINT);""")
+        # the days at midnight in Paris, as the analyzer dates them in a session of this timezone
+        cursor.execute("""INSERT INTO test_buckets.daystocks
+                          SELECT (d::date::timestamp AT TIME ZONE 'Europe/Paris'), 1, 1, 1, 1, 1, 1
+                          FROM generate_series('2021-01-01'::date, '2021-03-31', '1 day') d;""")
+    db = Database(dsn + " options='-c search_path=test_buckets,public -c TimeZone=Europe/Paris'",
+                  {"daystocks_buckets": utils.STATEMENTS["daystocks_buckets"]}, 1)
+    yield db
+    with conn.cursor() as cursor:
+        cursor.execute("DROP SCHEMA test_buckets CASCADE;")
+    conn.close()
+
+
+@pytest.mark.parametrize("bucket, first_days", [
+    ("1 week", ["2020-12-28", "2021-01-04", "2021-01-11"]),
+    ("1 month", ["2021-01-01", "2021-02-01", "2021-03-01"]),
+])
+def test_buckets_are_cut_in_the_session_timezone(paris_daystocks, bucket, first_days):
+    df = paris_daystocks.query("daystocks_buckets", [1], bucket, pd.Timestamp("2021-01-01", tz="Europe/Paris"),
+                               pd.Timestamp("2021-03-31", tz="Europe/Paris")).sort_values("date")
+    # a Monday or a 1st at midnight in Paris starts its bucket, not the previous one
+    expected = pd.DatetimeIndex(first_days).tz_localize("Europe/Paris")
+    assert df["date"].dt.tz_convert("Europe/Paris").iloc[:3].tolist() == expected.tolist()
+    assert df["volume"].sum() == 90
+    if bucket == "1 month":
+        assert df["volume"].tolist() == [31, 28, 31]
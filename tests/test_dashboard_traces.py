@@ -0,0 +1,29 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dashboard'))
+from traces import split_companies
+
+
+@pytest.mark.parametrize("unit", ["s", "ms", "us", "ns"])
+@pytest.mark.parametrize("tz", [None, "UTC", "Europe/Paris"])
+def test_split_companies_dates_in_any_unit(unit, tz):
+    dates = pd.to_datetime(["2021-03-02 10:00", "2021-03-01 10:00", "2021-03-01 10:00"])
+    if tz is not None:
+        dates = dates.tz_localize(tz)
+    df = pd.DataFrame({"date": dates, "cid": [1, 1, 2], "close": [2.0, 1.0, 3.0]})
+    df["date"] = df["date"].dt.as_unit(unit)
+
+    blocks = split_companies(df, [2, 1, 3], ["close"])
+
+    assert list(blocks) == [2, 1]
+    expected = pd.DatetimeIndex(["2021-03-01 10:00", "2021-03-02 10:00"])
+    if tz is not None:
+        expected = expected.tz_localize(tz).tz_convert("UTC").tz_localize(None)
+    np.testing.assert_array_equal(blocks[1]["date"], expected.to_numpy(dtype="datetime64[ns]"))
+    assert blocks[1]["date"].dtype == np.dtype("datetime64[ns]")
+    np.testing.assert_array_equal(blocks[1]["close"], [1.0, 2.0])
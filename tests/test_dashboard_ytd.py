@@ -0,0 +1,21 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dashboard'))
+from utils import compute_ytd
+
+
+def test_years_are_cut_in_the_session_timezone():
+    # the days at midnight in Paris, read back in UTC: January 1 starts on December 31 at 23:00
+    dates = pd.DatetimeIndex(["2020-12-30", "2020-12-31", "2021-01-01", "2021-01-04"]).tz_localize("Europe/Paris")
+    df = pd.DataFrame({"date": dates.tz_convert("UTC"), "close": [10.0, 20.0, 40.0, 60.0]})
+    baselines = pd.Series({2020: 10.0, 2021: 40.0})
+
+    np.testing.assert_allclose(compute_ytd(df, baselines, "Europe/Paris"), [0, 100, 0, 50])
+    # without baselines, the first close of the year in the session timezone
+    np.testing.assert_allclose(compute_ytd(df, None, "Europe/Paris"), [0, 100, 0, 50])
+    # in UTC January 1 at midnight in Paris is still in 2020
+    np.testing.assert_allclose(compute_ytd(df, baselines), [0, 100, 300, 50])